@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты загрузки сделок и записи Excel в trades_analyzer (pytest)
+Зависимости: pip install -r requirements-dev.txt
+"""
+
+import codecs
+import math
+import os
+
+import openpyxl
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from trades_analyzer import CSV_PROBE_SIZE, TradesAnalyzer, _direction_codes
+
+TRADES_HEADER = "Ticker;Price;Fee;Direction;Amount;DateCreate"
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    """Анализатор с папкой input во временной директории, без открытия Excel"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TRADES_NO_UI', '1')
+    return TradesAnalyzer(trades_directory=str(tmp_path))
+
+
+def write_csv(directory, lines, name="Trades_test.csv"):
+    """Записывает CSV со сделками и возвращает путь к нему"""
+    path = os.path.join(str(directory), name)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def test_excel_with_inf_price(analyzer, tmp_path):
+    """Бесконечная цена не прерывает запись книги"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;80000,5;1,2;Buy;2;10:00:00",
+        "SiU5;inf;1,2;Sell;1;10:00:01",
+        "RIU5;110000;2,5;Buy;3;00:00:00",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+    assert math.isinf(df['Price'].iloc[1])
+
+    analyzer.calculate_averages(df)
+    excel_path = analyzer.create_and_open_excel(df, csv_path)
+
+    assert excel_path and os.path.isfile(excel_path)
+    workbook = openpyxl.load_workbook(excel_path, read_only=True)
+    assert {'Данные', 'Статистика', 'Анализ_по_тикерам'} <= set(workbook.sheetnames)
+
+
+def test_data_sheet_writes_inf_as_error(analyzer, tmp_path):
+    """Числовые столбцы схемы пишут бесконечность ошибкой Excel, остальные ячейки - числами"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;80000,5;1,2;Buy;2;10:00:00",
+        "SiU5;inf;1,2;Sell;-inf;10:00:01",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+    excel_path = analyzer.create_and_open_excel(df, csv_path)
+
+    assert excel_path
+    sheet = openpyxl.load_workbook(excel_path, data_only=True)['Данные']
+    header = [cell.value for cell in sheet[1]]
+    price_col = header.index('Price') + 1
+    amount_col = header.index('Amount') + 1
+    assert sheet.cell(row=2, column=price_col).value == 80000.5
+    assert sheet.cell(row=3, column=price_col).value == '#DIV/0!'
+    assert sheet.cell(row=3, column=amount_col).value == '#DIV/0!'
+
+
+def test_date_column_kept_as_in_file(analyzer, tmp_path, monkeypatch):
+    """Столбец с датой вне схемы читается как в файле и совпадает с разбором pandas"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER + ";TradeDate",
+        "SiU5;80000,5;1,2;Buy;2;10:00:00;2025-09-20T10:00:00",
+        "RIU5;110000;2,5;Sell;3;00:00:00;2025-09-19 23:59:59.5",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+    assert df['TradeDate'].tolist() == ["2025-09-20T10:00:00", "2025-09-19 23:59:59.5"]
+
+    # Тот же файл через запасной путь pd.read_csv
+    monkeypatch.setattr(TradesAnalyzer, '_read_csv_arrow', staticmethod(lambda *args: None))
+    fallback_df = analyzer.load_trades(csv_path)
+    assert df['TradeDate'].tolist() == fallback_df['TradeDate'].tolist()
+    assert df['DateCreate'].tolist() == fallback_df['DateCreate'].tolist()
+
+
+def test_ticker_sheet_not_reused_from_previous_file(analyzer, tmp_path):
+    """Лист по тикерам не переносится из анализа предыдущего файла"""
+    first_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;80000,5;1,2;Buy;2;10:00:00",
+    ], name="Trades_first.csv")
+    analyzer.calculate_averages(analyzer.load_trades(first_path))
+
+    # Во втором файле нет Ticker - анализ по тикерам не выполняется
+    second_path = write_csv(tmp_path, [
+        "Price;Amount;DateCreate",
+        "100;1;10:00:00",
+    ], name="Trades_second.csv")
+    second_df = analyzer.load_trades(second_path)
+    analyzer.calculate_averages(second_df)
+    excel_path = analyzer.create_and_open_excel(second_df, second_path)
+
+    assert excel_path
+    assert 'Анализ_по_тикерам' not in openpyxl.load_workbook(excel_path, read_only=True).sheetnames
+
+
+def test_cp1251_after_probe_block(analyzer, tmp_path):
+    """Кириллица cp1251 после первых CSV_PROBE_SIZE байт: разбор повторяется в cp1251"""
+    lines = [TRADES_HEADER + ";Comment"]
+    lines += ["SiU5;80000,5;1,2;Buy;2;10:00:00;ok"] * 3000
+    lines.append("RIU5;110000;2,5;Sell;3;10:00:01;Перенос позиции")
+    csv_path = os.path.join(str(tmp_path), "Trades_cp1251.csv")
+    with open(csv_path, 'wb') as f:
+        data = ("\n".join(lines) + "\n").encode('cp1251')
+        assert data.index("Перенос".encode('cp1251')) > CSV_PROBE_SIZE
+        f.write(data)
+
+    df = analyzer.load_trades(csv_path)
+
+    assert df is not None
+    assert df.shape == (3001, 7)
+    assert df['Comment'].iloc[-1] == "Перенос позиции"
+
+
+def test_arrow_invalid_falls_back_to_pandas(analyzer, tmp_path):
+    """Числа с пробелами между разрядами pyarrow не разбирает - файл читает pandas"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;80 000,5;1,2;Buy;2;10:00:00",
+        "RIU5;110 000;2,5;Sell;3;00:00:00",
+    ])
+
+    with open(csv_path, 'rb') as f:
+        encoding, sep, decimal, header = TradesAnalyzer._detect_csv_format(f.read(CSV_PROBE_SIZE))
+        f.seek(0)
+        assert TradesAnalyzer._read_csv_arrow(f, encoding, sep, decimal, header) is None
+
+    df = analyzer.load_trades(csv_path)
+    assert df['Price'].tolist() == [80000.5, 110000.0]
+
+
+def test_arrow_decode_error_is_not_swallowed(tmp_path):
+    """Ошибка декодирования из pyarrow передается наверх, а не превращается в запасной разбор"""
+    csv_path = os.path.join(str(tmp_path), "Trades_bad.csv")
+    with open(csv_path, 'wb') as f:
+        f.write((TRADES_HEADER + "\nСиU5;1;1;Buy;1;10:00:00\n").encode('cp1251'))
+
+    with open(csv_path, 'rb') as f:
+        with pytest.raises(UnicodeDecodeError):
+            TradesAnalyzer._read_csv_arrow(f, 'utf-8-sig', ';', '.', TRADES_HEADER.split(';'))
+
+
+def test_vwap_flag_matches_vwap_rows(analyzer, tmp_path):
+    """Признак is_valid_vwap на листе данных отмечает ровно строки, вошедшие в VWAP"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;100;1;Buy;2;10:00:00",
+        "SiU5;inf;1;Sell;1;10:00:01",
+        "SiU5;;1;Sell;1;10:00:02",
+        "SiU5;300;1;Buy;4;10:00:03",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+    results = analyzer.calculate_averages(df)
+    excel_path = analyzer.create_and_open_excel(df, csv_path)
+
+    rows = list(openpyxl.load_workbook(excel_path, read_only=True)['Данные'].values)
+    flags = [row[rows[0].index('is_valid_vwap')] for row in rows[1:]]
+    assert flags == [True, False, False, True]
+    assert results['valid_trades_count'] == flags.count(True)
+    assert results['vwap_price'] == pytest.approx((100 * 2 + 300 * 4) / 6)
+
+
+def test_inf_price_dropped_from_all_reductions(analyzer, tmp_path):
+    """Бесконечная цена не входит ни в общие, ни в сессионные, ни в потикерные показатели"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER,
+        "SiU5;100;1;Buy;2;10:00:00",
+        "SiU5;inf;1;Sell;1;10:00:01",
+        "SiU5;300;1;Buy;4;10:00:02",
+        "RIU5;200;1;Sell;3;10:00:03",
+    ])
+
+    results = analyzer.calculate_averages(analyzer.load_trades(csv_path))
+
+    assert results['avg_Price'] == pytest.approx(200)
+    assert results['vwap_price'] == pytest.approx((100 * 2 + 300 * 4 + 200 * 3) / 9)
+
+    session = results['current_session_analysis']
+    assert session['current_session_avg_price'] == pytest.approx(200)
+    assert session['current_session_turnover'] == pytest.approx(2000)
+
+    ticker = results['ticker_analysis']['SiU5']
+    assert ticker['avg_price'] == pytest.approx(200)
+    assert ticker['max_price'] == 300
+    assert ticker['valid_price_trades'] == 2
+    assert ticker['total_amount'] == 7
+    assert ticker['net_amount'] == 5
+    assert ticker['vwap'] == pytest.approx(1400 / 6)
+    assert ticker['total_turnover'] == pytest.approx(1400)
+
+    session_ticker = session['current_session_ticker_analysis']['SiU5']
+    assert session_ticker['current_avg_price'] == pytest.approx(200)
+    assert session_ticker['current_max_price'] == 300
+    assert session_ticker['current_total_amount'] == 7
+    assert session_ticker['current_vwap'] == pytest.approx(1400 / 6)
+    assert session_ticker['current_turnover'] == pytest.approx(1400)
+
+
+# Набор для проверки агрегатов: пропуски цены и объема, пустой тикер,
+# перенос (00:00:00) и направление, отличное от Buy/Sell
+MIXED_TRADES = [
+    TRADES_HEADER,
+    "SiU5;100;1;Buy;2;10:00:00",
+    "SiU5;200;1;Sell;1;10:00:01",
+    "SiU5;;1;Buy;5;10:00:02",
+    "RIU5;50;1;Sell;;10:00:03",
+    "RIU5;70;1;Buy;4;00:00:00",
+    ";999;1;Buy;9;10:00:04",
+    "GZU5;10;1;Other;3;10:00:05",
+]
+
+
+def test_overall_totals(analyzer, tmp_path):
+    """Общий VWAP и суммы - только по строкам с заполненными Price и Amount"""
+    results = analyzer.calculate_averages(analyzer.load_trades(write_csv(tmp_path, MIXED_TRADES)))
+
+    assert results['total_trades'] == 7
+    assert results['valid_trades_count'] == 5
+    assert results['total_volume'] == pytest.approx(19)
+    assert results['total_turnover'] == pytest.approx(9701)
+    assert results['vwap_price'] == pytest.approx(9701 / 19)
+    assert results['weighted_avg_amount'] == pytest.approx(9701 / 1379)
+
+
+def test_ticker_analysis(analyzer, tmp_path):
+    """Показатели по тикерам: счетчики, цены, объемы, чистый объем и VWAP"""
+    results = analyzer.calculate_averages(analyzer.load_trades(write_csv(tmp_path, MIXED_TRADES)))
+    tickers = results['ticker_analysis']
+
+    # Сделка без тикера не образует группу (а не пустую группу nan с 0 сделок),
+    # порядок - по первой сделке
+    assert list(tickers) == ['SiU5', 'RIU5', 'GZU5']
+
+    si = tickers['SiU5']
+    assert (si['total_trades'], si['buy_trades'], si['sell_trades']) == (3, 2, 1)
+    assert (si['avg_price'], si['min_price'], si['max_price']) == (150, 100, 200)
+    assert si['valid_price_trades'] == 2
+    assert si['price_std'] == pytest.approx(np.std([100, 200], ddof=1))
+    assert si['total_amount'] == 8
+    assert (si['min_amount'], si['max_amount']) == (1, 5)
+    assert si['net_amount'] == 6
+    assert si['vwap'] == pytest.approx(400 / 3)
+    assert si['total_turnover'] == pytest.approx(400)
+
+    ri = tickers['RIU5']
+    assert (ri['total_trades'], ri['buy_trades'], ri['sell_trades']) == (2, 1, 1)
+    assert (ri['avg_price'], ri['min_price'], ri['max_price']) == (60, 50, 70)
+    assert ri['total_amount'] == 4
+    assert ri['net_amount'] == 4
+    assert ri['vwap'] == pytest.approx(70)
+
+    gz = tickers['GZU5']
+    assert (gz['total_trades'], gz['buy_trades'], gz['sell_trades']) == (1, 0, 0)
+    assert gz['net_amount'] == 0
+    assert gz['vwap'] == pytest.approx(10)
+
+
+def test_current_session_analysis(analyzer, tmp_path):
+    """Текущая сессия без переносов: общие суммы и показатели по тикерам"""
+    results = analyzer.calculate_averages(analyzer.load_trades(write_csv(tmp_path, MIXED_TRADES)))
+    session = results['current_session_analysis']
+
+    assert session['current_session_trades'] == 6
+    assert session['transfers_trades'] == 1
+    assert session['current_session_buy_trades'] == 3
+    assert session['current_session_sell_trades'] == 2
+    assert session['current_session_avg_price'] == pytest.approx(1309 / 4)
+    assert session['current_session_avg_amount'] == pytest.approx(15 / 4)
+    assert session['current_session_total_volume'] == pytest.approx(15)
+    assert session['current_session_turnover'] == pytest.approx(9421)
+    assert session['current_session_vwap'] == pytest.approx(9421 / 15)
+
+    tickers = session['current_session_ticker_analysis']
+    assert list(tickers) == ['SiU5', 'RIU5', 'GZU5']
+
+    si = tickers['SiU5']
+    assert (si['current_session_trades'], si['current_buy_trades'], si['current_sell_trades']) == (3, 2, 1)
+    assert (si['current_avg_price'], si['current_min_price'], si['current_max_price']) == (150, 100, 200)
+    assert si['current_avg_amount'] == pytest.approx(8 / 3)
+    assert si['current_total_amount'] == 8
+    assert si['current_net_amount'] == 6
+    assert si['current_vwap'] == pytest.approx(400 / 3)
+    assert si['current_turnover'] == pytest.approx(400)
+
+    # У RIU5 в сессии одна сделка без объема: объемные показатели не рассчитываются
+    ri = tickers['RIU5']
+    assert (ri['current_session_trades'], ri['current_buy_trades'], ri['current_sell_trades']) == (1, 0, 1)
+    assert (ri['current_min_price'], ri['current_max_price']) == (50, 50)
+    for key in ('current_avg_amount', 'current_total_amount', 'current_net_amount', 'current_vwap'):
+        assert key not in ri
+
+    gz = tickers['GZU5']
+    assert gz['current_net_amount'] == 0
+    assert gz['current_turnover'] == pytest.approx(30)
+
+
+def test_direction_codes():
+    """Buy - 1, Sell - -1, прочие значения и пропуски - 0"""
+    for dtype in (object, 'category'):
+        direction = pd.Series(['Buy', 'Sell', None, 'Other', 'Buy'], dtype=dtype)
+        codes = _direction_codes(direction)
+        assert codes.dtype == np.int8
+        assert codes.tolist() == [1, -1, 0, 0, 1]
+
+
+@pytest.mark.parametrize('lines, encoding, expected', [
+    (["Ticker;Price", "SiU5;80000,5"], 'utf-8', ('utf-8', ';', ',', ['Ticker', 'Price'])),
+    (["Ticker,Price", "SiU5,80000.5"], 'utf-8', ('utf-8', ',', '.', ['Ticker', 'Price'])),
+    (["Ticker\tPrice", "SiU5\t80000,5"], 'utf-8', ('utf-8', '\t', ',', ['Ticker', 'Price'])),
+    (["Тикер;Цена", "Си;1,5"], 'cp1251', ('cp1251', ';', ',', ['Тикер', 'Цена'])),
+])
+def test_detect_csv_format(lines, encoding, expected):
+    """Кодировка, разделитель, десятичный знак и заголовок по началу файла"""
+    head = ("\n".join(lines) + "\n").encode(encoding)
+    assert TradesAnalyzer._detect_csv_format(head) == expected
+
+
+def test_detect_csv_format_bom():
+    """Файл с BOM определяется как utf-8-sig, BOM не попадает в заголовок"""
+    head = codecs.BOM_UTF8 + "Ticker;Price\nSiU5;1\n".encode('utf-8')
+    assert TradesAnalyzer._detect_csv_format(head) == ('utf-8-sig', ';', '.', ['Ticker', 'Price'])
+
+
+def test_slash_separated_file(analyzer, tmp_path):
+    """Файл с разделителем "/" разбирается по столбцам с десятичной запятой"""
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER.replace(';', '/'),
+        "SiU5/80000,5/1,2/Buy/2/10:00:00",
+        "RIU5/110000/2,5/Sell/3/00:00:00",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+
+    assert list(df.columns) == TRADES_HEADER.split(';')
+    assert df['Price'].tolist() == [80000.5, 110000.0]
+    assert df['Fee'].tolist() == [1.2, 2.5]
+    assert df['DateCreate'].tolist() == ['10:00:00', '00:00:00']
+
+
+def test_manual_slash_split(analyzer, tmp_path, monkeypatch):
+    """Если файл прочитался одним столбцом, он делится по "/" вручную без битых строк"""
+    detect = TradesAnalyzer._detect_csv_format
+
+    def detect_as_semicolon(head, *args):
+        encoding, _, decimal, header = detect(head, *args)
+        return encoding, ';', decimal, header
+
+    monkeypatch.setattr(TradesAnalyzer, '_detect_csv_format', staticmethod(detect_as_semicolon))
+    csv_path = write_csv(tmp_path, [
+        TRADES_HEADER.replace(';', '/'),
+        "SiU5/80000,5/1,2/Buy/2/10:00:00",
+        "SiU5/broken",
+        "RIU5/110000/2,5/Sell/3/00:00:00",
+    ])
+
+    df = analyzer.load_trades(csv_path)
+
+    assert list(df.columns) == TRADES_HEADER.split(';')
+    assert df['Ticker'].tolist() == ['SiU5', 'RIU5']
+    assert df['Price'].tolist() == [80000.5, 110000.0]
+    assert df['Amount'].tolist() == [2, 3]
@@ -5,13 +5,20 @@
 Читает файлы сделок и вычисляет средние значения
 """
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import xlsxwriter
+import codecs
+import csv
 import os
+import re
 import shutil
 import subprocess
 import sys
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import logging
 
 # Настройка логирования
@@ -25,6 +32,255 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Размер буфера для чтения CSV и записи Excel (1 МБ вместо стандартных 8 КБ)
+IO_BUFFER_SIZE = 1 << 20
+
+# Определение формата CSV: объем начала файла для проверки кодировки,
+# число строк для определения разделителя и кандидаты
+CSV_PROBE_SIZE = 64 * 1024
+CSV_SNIFF_LINES = 50
+CSV_ENCODINGS = ['utf-8-sig', 'utf-8', 'cp1251']
+CSV_SEPARATORS = ';,\t|/'
+
+# Схема файла сделок: тип значений известных столбцов. По ней для каждого
+# столбца заранее выбирается метод записи ячеек в Excel
+TRADES_SCHEMA = {
+    'Ticker': 'categorical',
+    'Price': 'numeric',
+    'Fee': 'numeric',
+    'Direction': 'categorical',
+    'Amount': 'numeric',
+    'DateCreate': 'text'
+}
+
+# Настройки книги xlsxwriter: построчная запись с минимальным расходом памяти,
+# текст из CSV пишется как есть (без превращения в формулы и гиперссылки),
+# бесконечные значения (inf в Price/Amount и их средних) пишутся ошибками Excel,
+# а не прерывают запись всей книги
+XLSX_WORKBOOK_OPTIONS = {
+    'constant_memory': True,
+    'strings_to_formulas': False,
+    'strings_to_urls': False,
+    'nan_inf_to_errors': True
+}
+
+# Столбцы листа "Анализ_по_тикерам": показатель analyze_by_ticker -> заголовок
+TICKER_SHEET_COLUMNS = {
+    'ticker': 'Тикер',
+    'total_trades': 'Всего сделок',
+    'buy_trades': 'Buy сделок',
+    'sell_trades': 'Sell сделок',
+    'avg_price': 'Средняя цена',
+    'min_price': 'Мин цена',
+    'max_price': 'Макс цена',
+    'vwap': 'VWAP',
+    'avg_amount': 'Средний объем',
+    'total_amount': 'Общий объем',
+    'net_amount': 'Чистый объем (Buy-Sell)',
+    'total_turnover': 'Оборот'
+}
+
+# ioctl FICLONE (Linux): copy-on-write клон файла на Btrfs/XFS и других ФС с reflink
+FICLONE = 0x40049409
+
+
+def _trade_arrays(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Раскладывает используемые в расчетах столбцы сделок в непрерывные массивы NumPy
+    
+    Массивы строятся один раз на весь DataFrame (структура массивов), дальше все
+    агрегаты общего анализа, анализа по тикерам и текущей сессии считаются по ним
+    без выборок строк, индексов и выравнивания pandas.
+    
+    Args:
+        df: DataFrame с данными о сделках (Price и Amount уже приведены к числам)
+        
+    Returns:
+        Словарь: price, amount, pv (Price × Amount) - float64 длины len(df), NaN - пропуск;
+        dirs - коды направлений из _direction_codes или None без столбца Direction;
+        ticker_codes и tickers - коды и уникальные значения Ticker из pd.factorize
+        или None без столбца Ticker
+    """
+    missing = np.full(len(df), np.nan)
+    prices = df['Price'].to_numpy(dtype=np.float64) if 'Price' in df.columns else missing
+    amounts = df['Amount'].to_numpy(dtype=np.float64) if 'Amount' in df.columns else missing
+    
+    arrays = {
+        'price': prices,
+        'amount': amounts,
+        'pv': prices * amounts,
+        'dirs': _direction_codes(df['Direction']) if 'Direction' in df.columns else None,
+        'ticker_codes': None,
+        'tickers': None
+    }
+    if 'Ticker' in df.columns:
+        arrays['ticker_codes'], arrays['tickers'] = pd.factorize(df['Ticker'], sort=False)
+    
+    return arrays
+
+
+def _valid_price_amount(prices: np.ndarray, amounts: np.ndarray,
+                        pv: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Оставляет цены, объемы и Price × Amount сделок с заполненными (конечными) Price и Amount
+    
+    Args:
+        prices: Цены сделок (float64, NaN - пропуск)
+        amounts: Объемы сделок (float64, NaN - пропуск)
+        pv: Price × Amount тех же сделок
+        
+    Returns:
+        Непрерывные массивы float64 (цены, объемы, Price × Amount) одинаковой длины
+    """
+    # Одна маска по произведению: оно не конечно, если пропущено или бесконечно
+    # одно из значений, - такие сделки не входят ни в суммы, ни в количество
+    valid_mask = np.isfinite(pv)
+    return prices[valid_mask], amounts[valid_mask], pv[valid_mask]
+
+
+def _vwap_stats(prices: np.ndarray, amounts: np.ndarray, pv: np.ndarray) -> Tuple[int, float, float, float]:
+    """
+    Считает суммы, из которых складываются VWAP и средние по сделкам
+    
+    Args:
+        prices: Цены сделок без пропусков
+        amounts: Объемы сделок без пропусков
+        pv: Price × Amount тех же сделок
+        
+    Returns:
+        Кортеж (количество сделок, Σ(Amount), Σ(Price), оборот Σ(Price × Amount))
+    """
+    return len(prices), float(amounts.sum()), float(prices.sum()), float(pv.sum())
+
+
+def _ticker_vwap(codes: np.ndarray, tickers: Any, amounts: np.ndarray,
+                 pv: np.ndarray) -> pd.DataFrame:
+    """
+    Считает VWAP и оборот по каждому тикеру за один проход по массивам сделок
+    
+    Строки с пропусками в Ticker, Price или Amount отбрасываются одной маской,
+    суммы по кодам тикеров считает np.bincount.
+    
+    Args:
+        codes: Коды тикеров из pd.factorize (-1 - пропуск тикера)
+        tickers: Уникальные тикеры из pd.factorize
+        amounts: Объемы сделок (float64, NaN - пропуск)
+        pv: Price × Amount тех же сделок
+        
+    Returns:
+        DataFrame с индексом по тикерам и столбцами vwap, total_turnover
+        (только тикеры с ненулевым объемом)
+    """
+    valid_mask = (codes >= 0) & np.isfinite(pv)
+    
+    valid_codes = codes[valid_mask]
+    valid_amounts = amounts[valid_mask]
+    turnover = np.bincount(valid_codes, weights=pv[valid_mask], minlength=len(tickers))
+    volume = np.bincount(valid_codes, weights=valid_amounts, minlength=len(tickers))
+    
+    has_volume = volume > 0
+    return pd.DataFrame({
+        'vwap': turnover[has_volume] / volume[has_volume],
+        'total_turnover': turnover[has_volume]
+    }, index=tickers[has_volume])
+
+
+def _direction_codes(direction: pd.Series) -> np.ndarray:
+    """
+    Кодирует направления сделок числами: 1 - Buy, -1 - Sell, 0 - прочие и пропуски
+    
+    Строки сравниваются только для уникальных значений (для category - по категориям),
+    коды строк получаются одной выборкой по таблице соответствия.
+    
+    Args:
+        direction: Столбец Direction
+        
+    Returns:
+        Массив int8 длины len(direction)
+    """
+    codes, uniques = pd.factorize(direction, sort=False)
+    # Последний элемент таблицы соответствует коду -1 (пропуск)
+    lookup = np.array([1 if value == 'Buy' else -1 if value == 'Sell' else 0 for value in uniques] + [0],
+                      dtype=np.int8)
+    return lookup[codes]
+
+
+def _aggregate_tickers(codes: np.ndarray, dirs: Optional[np.ndarray], prices: np.ndarray,
+                       amounts: np.ndarray, n_groups: int,
+                       pv: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Считает все агрегаты сделок по тикерам по целочисленным кодам тикеров
+    
+    Каждый показатель - один линейный проход np.bincount по непрерывным массивам
+    (минимум и максимум - np.minimum.reduceat/np.maximum.reduceat по ценам,
+    один раз отсортированным по коду тикера), без построения Series и групп pandas.
+    Пропуски и бесконечные значения в Price и Amount отбрасываются для каждого
+    столбца отдельно, а оборот и объем для VWAP считаются только по строкам
+    с конечным Price × Amount.
+    
+    Args:
+        codes: Коды тикеров из pd.factorize (-1 - пропуск тикера)
+        dirs: Направления сделок (1 - Buy, -1 - Sell, 0 - прочие) или None
+        prices: Цены сделок (float64, NaN - пропуск)
+        amounts: Объемы сделок (float64, NaN - пропуск)
+        n_groups: Количество тикеров
+        pv: Уже посчитанный Price × Amount (если None - считается здесь)
+        
+    Returns:
+        Словарь массивов длины n_groups: trades, price_count, price_sum, price_min,
+        price_max, amount_count, amount_sum, turnover, volume, а при заданных
+        dirs также buy_trades, sell_trades, net_amount
+    """
+    if pv is None:
+        pv = prices * amounts
+    
+    has_ticker = codes >= 0
+    codes = codes[has_ticker]
+    prices = prices[has_ticker]
+    amounts = amounts[has_ticker]
+    pv = pv[has_ticker]
+    
+    result = {'trades': np.bincount(codes, minlength=n_groups)}
+    
+    has_price = np.isfinite(prices)
+    price_codes = codes[has_price]
+    valid_prices = prices[has_price]
+    result['price_count'] = np.bincount(price_codes, minlength=n_groups)
+    result['price_sum'] = np.bincount(price_codes, weights=valid_prices, minlength=n_groups)
+    result['price_min'] = np.full(n_groups, np.inf)
+    result['price_max'] = np.full(n_groups, -np.inf)
+    if len(valid_prices):
+        # После сортировки цены каждого тикера идут подряд; начала отрезков
+        # известны из количеств цен по тикерам
+        sorted_prices = valid_prices[np.argsort(price_codes, kind='stable')]
+        price_groups = np.flatnonzero(result['price_count'])
+        starts = (np.cumsum(result['price_count']) - result['price_count'])[price_groups]
+        result['price_min'][price_groups] = np.minimum.reduceat(sorted_prices, starts)
+        result['price_max'][price_groups] = np.maximum.reduceat(sorted_prices, starts)
+    
+    has_amount = np.isfinite(amounts)
+    amount_codes = codes[has_amount]
+    valid_amounts = amounts[has_amount]
+    result['amount_count'] = np.bincount(amount_codes, minlength=n_groups)
+    result['amount_sum'] = np.bincount(amount_codes, weights=valid_amounts, minlength=n_groups)
+    
+    # Оборот и объем для VWAP - только по строкам с заполненными Price и Amount
+    has_pv = np.isfinite(pv)
+    pv_codes = codes[has_pv]
+    result['turnover'] = np.bincount(pv_codes, weights=pv[has_pv], minlength=n_groups)
+    result['volume'] = np.bincount(pv_codes, weights=amounts[has_pv], minlength=n_groups)
+    
+    if dirs is not None:
+        dirs = dirs[has_ticker]
+        result['buy_trades'] = np.bincount(codes[dirs == 1], minlength=n_groups)
+        result['sell_trades'] = np.bincount(codes[dirs == -1], minlength=n_groups)
+        # Чистый объем с учетом направления (Buy: +, Sell: -)
+        result['net_amount'] = np.bincount(
+            amount_codes, weights=valid_amounts * dirs[has_amount], minlength=n_groups
+        )
+    
+    return result
+
 
 class TradesAnalyzer:
     """Класс для анализа торговых сделок"""
@@ -44,10 +300,10 @@ class TradesAnalyzer:
         self.auto_all_mode = (trades_directory == "auto_all")
         self.input_directory = os.path.join(os.getcwd(), "input")
         
-        # Создаем папку input если её нет
-        if not os.path.exists(self.input_directory):
-            os.makedirs(self.input_directory)
-            logger.info(f"Создана папка для входных файлов: {self.input_directory}")
+        # Создаем папку input если её нет (один системный вызов, без гонки exists/makedirs).
+        # Если по этому пути лежит обычный файл, ошибка возникает здесь, а не при записи
+        os.makedirs(self.input_directory, exist_ok=True)
+        logger.debug("Папка для входных файлов: %s", self.input_directory)
     
     def _choose_source_directory(self) -> str:
         """
@@ -149,11 +405,11 @@ class TradesAnalyzer:
         filename = f"Trades_{today}.csv"
         filepath = os.path.join(self.trades_directory, filename)
         
-        if os.path.exists(filepath):
-            logger.info(f"Найден файл сделок: {filepath}")
+        if os.path.isfile(filepath):
+            logger.info("Найден файл сделок: %s", filepath)
             return filepath
         else:
-            logger.warning(f"Файл сделок не найден: {filepath}")
+            logger.warning("Файл сделок не найден: %s", filepath)
             return None
     
     def copy_file_to_input(self, source_filepath: str) -> str:
@@ -190,14 +446,48 @@ class TradesAnalyzer:
             
             destination = os.path.join(self.input_directory, filename)
             
-            shutil.copy2(source_filepath, destination)
-            logger.info(f"Файл скопирован в input: {filename}")
+            if not self._clone_file(source_filepath, destination):
+                shutil.copy2(source_filepath, destination)
+            logger.info("Файл скопирован в input: %s", filename)
             return destination
             
         except Exception as e:
-            logger.error(f"Ошибка при копировании файла: {e}")
+            logger.error("Ошибка при копировании файла: %s", e)
             return source_filepath  # Возвращаем оригинальный путь если копирование не удалось
     
+    @staticmethod
+    def _clone_file(source_filepath: str, destination: str) -> bool:
+        """
+        Создает copy-on-write клон файла (reflink), если ФС это поддерживает
+        
+        Жесткая ссылка здесь не подходит: терминал дописывает файл сделок в течение
+        дня, а копия в input должна оставаться снимком на момент анализа.
+        
+        Args:
+            source_filepath: Путь к исходному файлу
+            destination: Путь к создаваемому файлу
+            
+        Returns:
+            True если клон создан, False если нужно обычное копирование
+        """
+        if not sys.platform.startswith('linux'):
+            return False
+        
+        import fcntl
+        
+        try:
+            with open(source_filepath, 'rb') as src, open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source_filepath, destination)
+            return True
+        except OSError:
+            # Другой том или ФС без reflink (ext4, tmpfs) - убираем пустой файл
+            try:
+                os.remove(destination)
+            except OSError:
+                pass
+            return False
+    
     def create_and_open_excel(self, df: pd.DataFrame, source_filepath: str) -> str:
         """
         Создает Excel файл из DataFrame и открывает его
@@ -215,75 +505,80 @@ class TradesAnalyzer:
             excel_filename = f"{base_name}_analyzed.xlsx"
             excel_path = os.path.join(self.input_directory, excel_filename)
             
-            # Создаем Excel файл с несколькими листами
-            with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-                # Основные данные
-                df.to_excel(writer, sheet_name='Данные', index=False)
+            # Создаем Excel файл с несколькими листами (через буферизованный файл).
+            # Листы пишутся построчно, поэтому xlsxwriter держит в памяти только одну строку
+            with open(excel_path, 'wb', buffering=IO_BUFFER_SIZE) as excel_file, \
+                    xlsxwriter.Workbook(excel_file, XLSX_WORKBOOK_OPTIONS) as workbook:
+                # Основные данные. Подмножества (валидные для VWAP, текущая сессия)
+                # не дублируются отдельными листами - вместо этого добавляются
+                # столбцы-признаки, по которым строки фильтруются автофильтром
+                row_flags = {}
+                if 'Price' in df.columns and 'Amount' in df.columns:
+                    # Та же маска, что и в расчете VWAP: конечное Price × Amount
+                    row_flags['is_valid_vwap'] = np.isfinite(
+                        df['Price'].to_numpy(dtype=np.float64) * df['Amount'].to_numpy(dtype=np.float64)
+                    )
+                if 'DateCreate' in df.columns:
+                    row_flags['is_current_session'] = self._current_session_mask(df)
+                data_sheet = self._write_sheet(workbook, 'Данные', df.assign(**row_flags))
+                data_sheet.autofilter(0, 0, len(df), len(df.columns) + len(row_flags) - 1)
                 
-                # Статистика по столбцам
-                stats_data = []
-                for col in df.columns:
-                    if col in ['Price', 'Amount']:
-                        numeric_col = pd.to_numeric(df[col], errors='coerce')
-                        stats_data.append({
-                            'Столбец': col,
-                            'Тип': str(df[col].dtype),
-                            'Всего значений': len(df[col]),
-                            'Пустых': df[col].isna().sum(),
-                            'Валидных числовых': numeric_col.notna().sum() if not numeric_col.empty else 0,
-                            'Минимум': numeric_col.min() if numeric_col.notna().any() else 'N/A',
-                            'Максимум': numeric_col.max() if numeric_col.notna().any() else 'N/A',
-                            'Среднее': numeric_col.mean() if numeric_col.notna().any() else 'N/A',
-                            'Сумма': numeric_col.sum() if numeric_col.notna().any() else 'N/A'
-                        })
-                    else:
-                        stats_data.append({
-                            'Столбец': col,
-                            'Тип': str(df[col].dtype),
-                            'Всего значений': len(df[col]),
-                            'Пустых': df[col].isna().sum(),
-                            'Уникальных': df[col].nunique(),
-                            'Примеры': ', '.join(map(str, df[col].dropna().head(3).tolist()))
-                        })
+                # Статистика по столбцам из сводок, посчитанных один раз на весь
+                # DataFrame: пропуски - одним isna(), числовые показатели - одним agg()
+                # по Price/Amount, уникальные значения - только по остальным столбцам
+                is_numeric_stat = df.columns.isin(['Price', 'Amount'])
+                numeric_df = df.loc[:, is_numeric_stat]
+                other_df = df.loc[:, ~is_numeric_stat]
+                
+                numeric_stat_names = ['count', 'min', 'max', 'mean', 'sum']
+                if len(numeric_df.columns) > 0:
+                    numeric_stats = numeric_df.agg(numeric_stat_names).T
+                    numeric_stats['sum'] = numeric_stats['sum'].where(numeric_stats['count'] > 0)
+                else:
+                    numeric_stats = pd.DataFrame(columns=numeric_stat_names)
+                numeric_stats = numeric_stats.reindex(df.columns)
                 
-                stats_df = pd.DataFrame(stats_data)
-                stats_df.to_excel(writer, sheet_name='Статистика', index=False)
+                # Примеры берем из первых строк; полный проход dropna() нужен
+                # только столбцам, у которых в первых строках есть пропуски
+                examples_head = other_df.head(3)
+                head_has_gaps = examples_head.isna().any()
+                examples = pd.Series({
+                    col: ', '.join(map(str, (other_df[col] if head_has_gaps[col] else examples_head[col]).dropna().head(3)))
+                    for col in other_df.columns
+                }, dtype=object)
+                
+                stats_df = pd.DataFrame({
+                    'Столбец': df.columns,
+                    'Тип': df.dtypes.astype(str),
+                    'Всего значений': len(df),
+                    'Пустых': df.isna().sum(),
+                    'Валидных числовых': numeric_stats['count'],
+                    'Минимум': numeric_stats['min'],
+                    'Максимум': numeric_stats['max'],
+                    'Среднее': numeric_stats['mean'],
+                    'Сумма': numeric_stats['sum'],
+                    'Уникальных': other_df.nunique().reindex(df.columns),
+                    'Примеры': examples.reindex(df.columns)
+                }, index=df.columns)
+                self._write_sheet(workbook, 'Статистика', stats_df)
                 
                 
                 # Анализ по тикерам (если есть результаты анализа)
-                if hasattr(self, '_last_ticker_analysis') and self._last_ticker_analysis:
-                    ticker_summary = []
-                    for ticker, data in self._last_ticker_analysis.items():
-                        row = {
-                            'Тикер': ticker,
-                            'Всего сделок': data.get('total_trades', 0),
-                            'Buy сделок': data.get('buy_trades', 0),
-                            'Sell сделок': data.get('sell_trades', 0),
-                            'Средняя цена': data.get('avg_price', 'N/A'),
-                            'Мин цена': data.get('min_price', 'N/A'),
-                            'Макс цена': data.get('max_price', 'N/A'),
-                            'VWAP': data.get('vwap', 'N/A'),
-                            'Средний объем': data.get('avg_amount', 'N/A'),
-                            'Общий объем': data.get('total_amount', 'N/A'),
-                            'Чистый объем (Buy-Sell)': data.get('net_amount', 'N/A'),
-                            'Оборот': data.get('total_turnover', 'N/A')
-                        }
-                        ticker_summary.append(row)
-                    
-                    if ticker_summary:
-                        ticker_df = pd.DataFrame(ticker_summary)
-                        ticker_df.to_excel(writer, sheet_name='Анализ_по_тикерам', index=False)
+                # Лист строится прямо из DataFrame агрегатов analyze_by_ticker,
+                # без промежуточного словаря по каждому тикеру
+                ticker_stats = getattr(self, '_last_ticker_stats', None)
+                if ticker_stats is not None and len(ticker_stats) > 0:
+                    ticker_df = ticker_stats.reindex(columns=list(TICKER_SHEET_COLUMNS)).rename(columns=TICKER_SHEET_COLUMNS)
+                    counts = ['Всего сделок', 'Buy сделок', 'Sell сделок']
+                    ticker_df[counts] = ticker_df[counts].fillna(0)
+                    values = ticker_df.columns.difference(['Тикер'] + counts, sort=False)
+                    ticker_df[values] = ticker_df[values].astype(object).where(ticker_df[values].notna(), 'N/A')
+                    self._write_sheet(workbook, 'Анализ_по_тикерам', ticker_df)
                 
-                # Сделки текущей сессии (исключая переносы с 00:00:00)
+                # Анализ сделок текущей сессии (исключая переносы с 00:00:00)
                 if hasattr(self, '_last_current_session_analysis') and self._last_current_session_analysis:
                     current_session_data = self._last_current_session_analysis
                     
-                    # Лист с сделками текущей сессии
-                    if 'current_session_dataframe' in current_session_data:
-                        current_df = current_session_data['current_session_dataframe']
-                        if len(current_df) > 0:
-                            current_df.to_excel(writer, sheet_name='Текущая_сессия', index=False)
-                    
                     # Анализ по тикерам для текущей сессии
                     if 'current_session_ticker_analysis' in current_session_data:
                         current_ticker_summary = []
@@ -306,113 +601,173 @@ class TradesAnalyzer:
                         
                         if current_ticker_summary:
                             current_ticker_df = pd.DataFrame(current_ticker_summary)
-                            current_ticker_df.to_excel(writer, sheet_name='Сессия_по_тикерам', index=False)
-                
-                # Настраиваем ширину столбцов для всех листов (в самом конце)
-                self._adjust_column_widths(writer)
-                
-                # Устанавливаем активный лист "Сессия_по_тикерам" при открытии
-                if 'Сессия_по_тикерам' in writer.sheets:
-                    workbook = writer.book
-                    workbook.active = writer.sheets['Сессия_по_тикерам']
-                    logger.info("Установлен активный лист: Сессия_по_тикерам")
+                            session_sheet = self._write_sheet(workbook, 'Сессия_по_тикерам', current_ticker_df)
+                            
+                            # Устанавливаем активный лист "Сессия_по_тикерам" при открытии
+                            session_sheet.activate()
+                            logger.info("Установлен активный лист: Сессия_по_тикерам")
+            
+            logger.info("Excel файл создан: %s", excel_filename)
             
-            logger.info(f"Excel файл создан: {excel_filename}")
+            # Открываем Excel файл только при интерактивном запуске: в пакетном
+            # режиме (ввод не из терминала или TRADES_NO_UI=1) файл просто сохраняется
+            interactive = sys.stdin is not None and sys.stdin.isatty()
+            if not interactive or os.environ.get('TRADES_NO_UI'):
+                logger.info("Пакетный режим: Excel файл не открывается автоматически (%s)", excel_path)
+                return excel_path
             
-            # Открываем Excel файл
             try:
+                # Запускаем просмотрщик без ожидания его завершения
                 if sys.platform == "win32":
                     os.startfile(excel_path)
                 elif sys.platform == "darwin":  # macOS
-                    subprocess.run(["open", excel_path])
+                    subprocess.Popen(["open", excel_path])
                 else:  # Linux
-                    subprocess.run(["xdg-open", excel_path])
+                    subprocess.Popen(["xdg-open", excel_path])
                 
-                logger.info(f"Excel файл открыт: {excel_filename}")
+                logger.info("Excel файл открыт: %s", excel_filename)
                 
                 # Файл открыт автоматически для просмотра
                 logger.info("Финальный аналитический Excel файл открыт для просмотра")
                 
             except Exception as e:
-                logger.warning(f"Не удалось автоматически открыть Excel файл: {e}")
-                logger.info(f"Вы можете открыть файл вручную: {excel_path}")
+                logger.warning("Не удалось автоматически открыть Excel файл: %s", e)
+                logger.info("Вы можете открыть файл вручную: %s", excel_path)
                 
             return excel_path
             
         except Exception as e:
-            logger.error(f"Ошибка при создании Excel файла: {e}")
+            logger.error("Ошибка при создании Excel файла: %s", e)
             return ""
     
-    def _adjust_column_widths(self, writer):
+    def _write_sheet(self, workbook, sheet_name: str, df: pd.DataFrame):
         """
-        Автоматически настраивает ширину столбцов для всех листов в Excel файле
+        Записывает DataFrame на новый лист книги xlsxwriter построчно
+        
+        Строки пишутся напрямую через write_row, минуя ExcelFormatter pandas
+        (объект Cell и преобразование стилей на каждое значение), поэтому запись
+        совместима с режимом constant_memory.
+        
+        Args:
+            workbook: Книга xlsxwriter
+            sheet_name: Имя листа
+            df: DataFrame с данными листа
+            
+        Returns:
+            Созданный лист xlsxwriter
+        """
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        
+        # Метод записи выбирается один раз на столбец, а не на каждую ячейку.
+        # Пустые значения (NaN/None) оставляем пустыми ячейками
+        writers = self._column_writers(worksheet, df)
+        values = df.astype(object).where(df.notna(), None)
+        for row_idx, row in enumerate(values.itertuples(index=False, name=None), 1):
+            for col_idx, value in enumerate(row):
+                if value is not None:
+                    writers[col_idx](row_idx, col_idx, value)
+        
+        self._set_column_widths(worksheet, df)
+        return worksheet
+    
+    @staticmethod
+    def _column_writers(worksheet, df: pd.DataFrame) -> list:
+        """
+        Подбирает метод записи ячеек для каждого столбца по TRADES_SCHEMA
+        
+        Столбцы схемы пишутся напрямую через write_number/write_string без
+        проверки типа каждого значения. Неизвестные столбцы и столбцы, тип
+        которых не совпал со схемой, пишутся универсальным worksheet.write.
+        Бесконечные числа write_number пишет ошибками Excel (книга создается
+        с nan_inf_to_errors из XLSX_WORKBOOK_OPTIONS), NaN в ячейки не попадают.
         
         Args:
-            writer: ExcelWriter объект
+            worksheet: Лист xlsxwriter
+            df: DataFrame, записываемый на лист
+            
+        Returns:
+            Список методов записи в порядке столбцов DataFrame
+        """
+        writers = []
+        for col_idx, col in enumerate(df.columns):
+            kind = TRADES_SCHEMA.get(col)
+            series = df.iloc[:, col_idx]
+            
+            if kind == 'numeric' and pd.api.types.is_numeric_dtype(series.dtype) \
+                    and not pd.api.types.is_bool_dtype(series.dtype):
+                writers.append(worksheet.write_number)
+                continue
+            
+            if kind in ('categorical', 'text'):
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    inferred = pd.api.types.infer_dtype(series.cat.categories, skipna=True)
+                else:
+                    inferred = pd.api.types.infer_dtype(series, skipna=True)
+                if inferred in ('string', 'empty'):
+                    writers.append(worksheet.write_string)
+                    continue
+            
+            writers.append(worksheet.write)
+        return writers
+    
+    def _set_column_widths(self, worksheet, df: pd.DataFrame):
+        """
+        Настраивает ширину столбцов листа xlsxwriter по содержимому DataFrame
+        
+        Args:
+            worksheet: Лист xlsxwriter
+            df: DataFrame, записанный на лист
         """
         try:
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
+            for col_idx, col in enumerate(df.columns):
+                header = str(col)
+                max_length = len(header)
+                # Пропуски в строковом представлении остаются NaN и не учитываются
+                longest_value = df.iloc[:, col_idx].astype(str).str.len().max()
+                if pd.notna(longest_value):
+                    max_length = max(max_length, int(longest_value))
                 
-                # Автоматическая ширина столбцов
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    
-                    # Проходим по всем ячейкам в столбце
-                    for cell in column:
-                        try:
-                            cell_value = str(cell.value) if cell.value is not None else ""
-                            # Учитываем длину содержимого ячейки
-                            if len(cell_value) > max_length:
-                                max_length = len(cell_value)
-                        except:
-                            pass
-                    
-                    # Устанавливаем ширину с запасом
-                    # Минимум 10 символов, максимум 60, плюс запас 3 символа
-                    adjusted_width = max(10, min(max_length + 3, 60))
-                    
-                    # Для некоторых типов столбцов устанавливаем минимальную ширину
-                    if any(keyword in str(column[0].value).lower() for keyword in ['цена', 'price', 'vwap', 'оборот', 'объем']):
-                        adjusted_width = max(adjusted_width, 15)
-                    
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-                    
-                logger.info(f"Настроена ширина столбцов для листа '{sheet_name}'")
-                    
+                # Минимум 10 символов, максимум 60, плюс запас 3 символа
+                adjusted_width = max(10, min(max_length + 3, 60))
+                
+                # Для некоторых типов столбцов устанавливаем минимальную ширину
+                if any(keyword in header.lower() for keyword in ['цена', 'price', 'vwap', 'оборот', 'объем']):
+                    adjusted_width = max(adjusted_width, 15)
+                
+                worksheet.set_column(col_idx, col_idx, adjusted_width)
+            
+            logger.debug("Настроена ширина столбцов для листа '%s'", worksheet.name)
+            
         except Exception as e:
-            logger.warning(f"Ошибка при настройке ширины столбцов: {e}")
+            logger.warning("Ошибка при настройке ширины столбцов: %s", e)
     
-    def create_parsed_excel(self, df: pd.DataFrame, source_filepath: str) -> str:
+    def create_parsed_dump(self, df: pd.DataFrame, source_filepath: str) -> str:
         """
-        Создает простой Excel файл с распарсенными данными
+        Сохраняет распарсенные данные в Parquet (промежуточный файл, не для просмотра)
         
         Args:
             df: DataFrame с данными
             source_filepath: Путь к исходному файлу
             
         Returns:
-            Путь к созданному Excel файлу
+            Путь к созданному Parquet файлу
         """
         try:
-            # Формируем имя Excel файла (используем имя скопированного файла без добавления нового timestamp)
+            # Формируем имя файла (используем имя скопированного файла без добавления нового timestamp)
             base_name = os.path.splitext(os.path.basename(source_filepath))[0]
-            excel_filename = f"{base_name}_parsed.xlsx"
-            excel_path = os.path.join(self.input_directory, excel_filename)
+            dump_filename = f"{base_name}_parsed.parquet"
+            dump_path = os.path.join(self.input_directory, dump_filename)
             
-            # Создаем простой Excel файл только с данными
-            with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Распарсенные_данные', index=False)
-                
-                # Настраиваем ширину столбцов
-                self._adjust_column_widths(writer)
+            # Колоночная запись Arrow прямо из буферов столбцов, без построчной конвертации
+            df.to_parquet(dump_path, engine='pyarrow', compression='zstd', index=False)
             
-            logger.info(f"Распарсенный Excel файл создан: {excel_filename}")
-            return excel_path
+            logger.info("Распарсенные данные сохранены: %s", dump_filename)
+            return dump_path
             
         except Exception as e:
-            logger.error(f"Ошибка при создании распарсенного Excel файла: {e}")
+            logger.error("Ошибка при сохранении распарсенных данных: %s", e)
             return ""
     
     def load_trades(self, filepath: str) -> Optional[pd.DataFrame]:
@@ -423,75 +778,203 @@ class TradesAnalyzer:
             filepath: Путь к CSV файлу
             
         Returns:
-            DataFrame с данными о сделках или None при ошибке
+            DataFrame с данными о сделках (Price, Fee, Amount - числа, Ticker и
+            Direction - category) или None при ошибке
         """
         try:
-            # Пробуем разные кодировки и разделители
-            encodings = ['utf-8', 'cp1251', 'windows-1251', 'utf-8-sig']
-            separators = [';', ',', '\t', '|', '/']
-            
-            for encoding in encodings:
-                for sep in separators:
+            # Кодировку, разделитель, десятичный знак и заголовок определяем по началу
+            # файла, после чего файл разбирается целиком. Если байты другой кодировки
+            # встречаются только дальше начала файла, разбор повторяется со следующей
+            # кодировкой из CSV_ENCODINGS
+            with open(filepath, 'rb', buffering=IO_BUFFER_SIZE) as csv_file:
+                head = csv_file.read(CSV_PROBE_SIZE)
+                encodings = CSV_ENCODINGS
+                while True:
+                    csv_format = self._detect_csv_format(head, encodings)
+                    if csv_format is None:
+                        logger.error("Не удалось определить кодировку файла %s", filepath)
+                        return None
+                    
+                    encoding, sep, decimal, header = csv_format
                     try:
-                        df = pd.read_csv(filepath, encoding=encoding, sep=sep)
-                        
-                        # Проверяем, что данные разделились правильно
-                        if len(df.columns) > 1:
-                            logger.info(f"Файл успешно загружен с кодировкой {encoding} и разделителем '{sep}'")
-                            logger.info(f"Загружено {len(df)} строк, {len(df.columns)} столбцов")
-                            logger.info(f"Столбцы: {list(df.columns)}")
-                            return df
-                        elif len(df.columns) == 1:
-                            # Если один столбец, пробуем разделить его вручную
-                            column_name = df.columns[0]
-                            if '/' in column_name:
-                                # Разделяем заголовок
-                                headers = column_name.split('/')
-                                # Разделяем данные
-                                data_rows = []
-                                for _, row in df.iterrows():
-                                    row_data = str(row[column_name]).strip()
-                                    # Пропускаем пустые строки
-                                    if not row_data or row_data == 'nan':
-                                        continue
-                                    values = row_data.split('/')
-                                    if len(values) == len(headers):
-                                        # Очищаем пустые значения и заменяем запятые на точки в числах
-                                        cleaned_values = []
-                                        for i, val in enumerate(values):
-                                            val = val.strip()
-                                            # Для Price, Fee, Amount заменяем запятые на точки
-                                            if headers[i] in ['Price', 'Fee', 'Amount'] and val:
-                                                val = val.replace(',', '.')
-                                            # Заменяем пустые строки на None для численных полей
-                                            if val == '' and headers[i] in ['Price', 'Fee', 'Amount']:
-                                                val = None
-                                            cleaned_values.append(val)
-                                        data_rows.append(cleaned_values)
-                                
-                                if data_rows:
-                                    new_df = pd.DataFrame(data_rows, columns=headers)
-                                    # Пытаемся преобразовать численные столбцы
-                                    for col in new_df.columns:
-                                        if col in ['Price', 'Fee', 'Amount']:
-                                            new_df[col] = pd.to_numeric(new_df[col], errors='coerce')
-                                    
-                                    logger.info(f"Файл разделен вручную: {len(new_df)} строк, {len(new_df.columns)} столбцов")
-                                    logger.info(f"Столбцы: {list(new_df.columns)}")
-                                    return new_df
-                    except UnicodeDecodeError:
-                        continue
-                    except Exception as e:
-                        logger.debug(f"Попытка с кодировкой {encoding} и разделителем '{sep}': {e}")
-                        continue
+                        csv_file.seek(0)
+                        df = self._read_csv_arrow(csv_file, encoding, sep, decimal, header)
+                        if df is None:
+                            csv_file.seek(0)
+                            df = pd.read_csv(csv_file, encoding=encoding, sep=sep, decimal=decimal)
+                        break
+                    except UnicodeDecodeError as e:
+                        logger.info("Файл %s не читается в кодировке %s (%s), пробуем следующую",
+                                    filepath, encoding, e)
+                        encodings = CSV_ENCODINGS[CSV_ENCODINGS.index(encoding) + 1:]
             
-            logger.error(f"Не удалось загрузить файл ни с одной из комбинаций")
+            # Проверяем, что данные разделились правильно
+            if len(df.columns) > 1:
+                self._coerce_numeric_columns(df)
+                self._categorize_columns(df)
+                logger.info("Файл успешно загружен с кодировкой %s и разделителем '%s'", encoding, sep)
+                logger.info("Загружено %d строк, %d столбцов", len(df), len(df.columns))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Столбцы: %s", list(df.columns))
+                return df
+            
+            # Если один столбец, пробуем разделить его вручную
+            column_name = df.columns[0]
+            if '/' in column_name:
+                # Разделяем заголовок
+                headers = column_name.split('/')
+                # Разделяем данные строковыми операциями pandas сразу по всему столбцу.
+                # Пустые строки и строки с другим числом полей пропускаем
+                rows = df[column_name].dropna().astype(str).str.strip()
+                rows = rows[(rows != '') & (rows.str.count('/') == len(headers) - 1)]
+                
+                if len(rows) > 0:
+                    new_df = rows.str.split('/', expand=True).reset_index(drop=True)
+                    new_df.columns = headers
+                    new_df = new_df.apply(lambda col: col.str.strip())
+                    # Price, Fee, Amount: запятые заменяются на точки, пустые значения - NaN
+                    self._coerce_numeric_columns(new_df)
+                    self._categorize_columns(new_df)
+                    
+                    logger.info("Файл разделен вручную: %d строк, %d столбцов", len(new_df), len(new_df.columns))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Столбцы: %s", list(new_df.columns))
+                    return new_df
+            
+            logger.error("Не удалось разделить файл %s на столбцы", filepath)
             return None
             
         except Exception as e:
-            logger.error(f"Ошибка при загрузке файла {filepath}: {e}")
+            logger.error("Ошибка при загрузке файла %s: %s", filepath, e)
             return None
     
+    @staticmethod
+    def _read_csv_arrow(csv_file, encoding: str, sep: str, decimal: str,
+                        header: list) -> Optional[pd.DataFrame]:
+        """
+        Разбирает CSV многопоточным парсером pyarrow
+        
+        Типы всех столбцов задаются сразу при разборе: числа из TRADES_SCHEMA -
+        float64, остальные - строки. Так pyarrow не распознает дату/время сам
+        и значения остаются в исходном виде, как их читает pandas.
+        
+        Args:
+            csv_file: Открытый в бинарном режиме файл, позиция в начале
+            encoding: Кодировка файла
+            sep: Разделитель столбцов
+            decimal: Десятичный знак
+            header: Имена столбцов из заголовка файла
+            
+        Returns:
+            DataFrame или None, если pyarrow не смог разобрать файл
+        """
+        column_types = {
+            col: pa.float64() if TRADES_SCHEMA.get(col) == 'numeric' else pa.string()
+            for col in dict.fromkeys([*TRADES_SCHEMA, *header])
+        }
+        try:
+            table = pacsv.read_csv(
+                csv_file,
+                read_options=pacsv.ReadOptions(encoding=encoding),
+                parse_options=pacsv.ParseOptions(delimiter=sep),
+                convert_options=pacsv.ConvertOptions(
+                    column_types=column_types,
+                    decimal_point=decimal,
+                    strings_can_be_null=True
+                )
+            )
+        except pa.ArrowInvalid as e:
+            # Например, пробелы между разрядами в числах - их разберет pandas.
+            # Ошибки декодирования не перехватываются: их обрабатывает load_trades,
+            # повторяя разбор со следующей кодировкой
+            logger.debug("pyarrow не смог разобрать CSV, используется pandas: %s", e)
+            return None
+        
+        return table.to_pandas()
+    
+    @staticmethod
+    def _detect_csv_format(head: bytes, encodings: list = CSV_ENCODINGS) -> Optional[tuple]:
+        """
+        Определяет кодировку, разделитель и десятичный знак CSV по началу файла
+        
+        Args:
+            head: Первые байты файла (до CSV_PROBE_SIZE)
+            encodings: Кодировки-кандидаты в порядке проверки
+            
+        Returns:
+            Кортеж (кодировка, разделитель, десятичный знак, имена столбцов заголовка)
+            или None, если начало файла не декодируется ни одной из encodings
+        """
+        sample = None
+        for encoding in encodings:
+            if encoding == 'utf-8-sig' and not head.startswith(codecs.BOM_UTF8):
+                continue
+            try:
+                # Инкрементальный декодер не падает на символе, обрезанном границей блока
+                sample = codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+                break
+            except UnicodeDecodeError:
+                continue
+        
+        if sample is None:
+            return None
+        
+        # Разделитель определяем по первым строкам, отбросив последнюю (возможно неполную)
+        lines = sample.splitlines()
+        if len(head) == CSV_PROBE_SIZE and len(lines) > 1:
+            lines = lines[:-1]
+        sniff_sample = '\n'.join(lines[:CSV_SNIFF_LINES])
+        
+        try:
+            sep = csv.Sniffer().sniff(sniff_sample, delimiters=CSV_SEPARATORS).delimiter
+        except csv.Error:
+            # Не удалось определить по согласованности строк - берем самый частый в заголовке
+            header = lines[0] if lines else ''
+            sep = max(CSV_SEPARATORS, key=header.count)
+        
+        # Десятичная запятая (1234,5) разбирается сразу парсером read_csv
+        decimal = ',' if sep != ',' and re.search(r'\d,\d', sniff_sample) else '.'
+        header = next(csv.reader(lines[:1], delimiter=sep), [])
+        return encoding, sep, decimal, header
+    
+    @staticmethod
+    def _coerce_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Приводит столбцы Price, Fee и Amount к числам на месте (без копии DataFrame)
+        
+        Преобразуются только столбцы, которые read_csv не распознал как числа:
+        десятичная запятая или пробелы между разрядами.
+        
+        Args:
+            df: DataFrame с данными о сделках
+            
+        Returns:
+            Тот же DataFrame
+        """
+        for col in ['Price', 'Fee', 'Amount']:
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+                normalized = df[col].astype(str).str.replace(r'\s', '', regex=True).str.replace(',', '.', regex=False)
+                df[col] = pd.to_numeric(normalized, errors='coerce')
+        return df
+    
+    @staticmethod
+    def _categorize_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Переводит низкокардинальные столбцы (категории по TRADES_SCHEMA) в dtype category на месте
+        
+        Сравнения вида == 'Buy' и группировки по Ticker затем идут по целочисленным кодам.
+        
+        Args:
+            df: DataFrame с данными о сделках
+            
+        Returns:
+            Тот же DataFrame
+        """
+        for col, kind in TRADES_SCHEMA.items():
+            if kind == 'categorical' and col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        return df
+    
     def calculate_averages(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
         Вычисляет средние и средневзвешенные значения по сделкам
@@ -504,55 +987,61 @@ class TradesAnalyzer:
         """
         results = {}
         
+        # Результаты для листов Excel относятся только к этому DataFrame: если анализ
+        # ниже прервется, в книгу не должны попасть данные предыдущего файла
+        self._last_ticker_stats = None
+        self._last_current_session_analysis = None
+        
         try:
-            # Краткая информация о данных
-            logger.info(f"Загружено {len(df)} строк с {len(df.columns)} столбцами: {list(df.columns)}")
+            # Краткая информация о данных (список столбцов - только в отладочном режиме)
+            logger.info("Загружено %d строк с %d столбцами", len(df), len(df.columns))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Столбцы: %s", list(df.columns))
+            
+            # Price, Fee и Amount приводятся к числам один раз и на месте (для DataFrame
+            # из load_trades это уже сделано), дальше все расчеты и Excel используют их напрямую
+            self._coerce_numeric_columns(df)
             
             # Определяем численные столбцы
             numeric_columns = df.select_dtypes(include=['int64', 'float64']).columns
             
             if len(numeric_columns) == 0:
                 logger.warning("Не найдено численных столбцов для расчета средних")
-                # Попробуем принудительно преобразовать Price и Amount
-                if 'Price' in df.columns and 'Amount' in df.columns:
-                    logger.info("Пытаемся принудительно преобразовать Price и Amount в числа")
-                    df_copy = df.copy()
-                    df_copy['Price'] = pd.to_numeric(df_copy['Price'], errors='coerce')
-                    df_copy['Amount'] = pd.to_numeric(df_copy['Amount'], errors='coerce')
-                    
-                    # Обновляем список численных столбцов
-                    numeric_columns = df_copy.select_dtypes(include=['int64', 'float64']).columns
-                    df = df_copy
-                    logger.info(f"После преобразования численных столбцов: {list(numeric_columns)}")
             
-            # Вычисляем простые средние для всех численных столбцов
+            # Вычисляем простые средние для всех численных столбцов. Как и в VWAP,
+            # учитываются только конечные значения (без пропусков и бесконечностей)
             for col in numeric_columns:
-                if not df[col].isna().all():  # Проверяем, что столбец не пустой
-                    mean_value = df[col].mean()
-                    results[f'avg_{col}'] = mean_value
+                values = df[col].to_numpy(dtype=np.float64)
+                finite_values = values[np.isfinite(values)]
+                if len(finite_values) > 0:  # Проверяем, что столбец не пустой
+                    results[f'avg_{col}'] = finite_values.mean()
+            
+            # Цены, объемы, Price × Amount, коды направлений и тикеров раскладываются
+            # в массивы один раз и переиспользуются в общем VWAP, анализе по тикерам
+            # и анализе текущей сессии
+            arrays = _trade_arrays(df)
             
             # Вычисляем средневзвешенные значения (VWAP)
             if 'Price' in df.columns and 'Amount' in df.columns:
-                # Убираем строки с NaN значениями
-                clean_df = df[['Price', 'Amount']].dropna()
+                # Убираем строки с NaN значениями и работаем с непрерывными массивами
+                # float64 напрямую, без создания Series и выравнивания индексов pandas
+                valid_count, total_volume, total_price_weight, total_turnover = _vwap_stats(
+                    *_valid_price_amount(arrays['price'], arrays['amount'], arrays['pv'])
+                )
                 
-                if len(clean_df) > 0:
+                if valid_count > 0:
                     # VWAP = Σ(Price × Amount) / Σ(Amount)
-                    total_volume = clean_df['Amount'].sum()
                     if total_volume > 0:
-                        vwap = (clean_df['Price'] * clean_df['Amount']).sum() / total_volume
-                        results['vwap_price'] = vwap
+                        results['vwap_price'] = total_turnover / total_volume
                         
                         # Средний размер сделки взвешенный по цене
-                        total_price_weight = clean_df['Price'].sum()
                         if total_price_weight > 0:
-                            weighted_avg_amount = (clean_df['Amount'] * clean_df['Price']).sum() / total_price_weight
-                            results['weighted_avg_amount'] = weighted_avg_amount
+                            results['weighted_avg_amount'] = total_turnover / total_price_weight
                     
                     # Дополнительная статистика
                     results['total_volume'] = total_volume
-                    results['total_turnover'] = (clean_df['Price'] * clean_df['Amount']).sum()
-                    results['valid_trades_count'] = len(clean_df)
+                    results['total_turnover'] = total_turnover
+                    results['valid_trades_count'] = valid_count
             
             # Общая статистика
             results['total_trades'] = len(df)
@@ -560,28 +1049,28 @@ class TradesAnalyzer:
             
             # Анализ по тикерам
             if 'Ticker' in df.columns:
-                ticker_analysis = self.analyze_by_ticker(df)
+                ticker_analysis = self.analyze_by_ticker(df, arrays)
                 results['ticker_analysis'] = ticker_analysis
-                # Сохраняем для использования в Excel
-                self._last_ticker_analysis = ticker_analysis
             
             # Анализ сделок текущей сессии (исключая переносы с 00:00:00)
-            current_session_analysis = self.analyze_current_session_trades(df)
+            current_session_analysis = self.analyze_current_session_trades(df, arrays)
             results['current_session_analysis'] = current_session_analysis
             # Сохраняем для использования в Excel
             self._last_current_session_analysis = current_session_analysis
             
         except Exception as e:
-            logger.error(f"Ошибка при вычислении средних: {e}")
+            logger.error("Ошибка при вычислении средних: %s", e)
         
         return results
     
-    def analyze_by_ticker(self, df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    def analyze_by_ticker(self, df: pd.DataFrame,
+                          arrays: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
         """
         Анализирует сделки по каждому тикеру отдельно
         
         Args:
             df: DataFrame с данными о сделках
+            arrays: Массивы столбцов из _trade_arrays(df) (если None - строятся здесь)
             
         Returns:
             Словарь с анализом по каждому тикеру
@@ -589,75 +1078,95 @@ class TradesAnalyzer:
         ticker_results = {}
         
         try:
-            # Группируем по тикерам
-            for ticker in df['Ticker'].unique():
-                ticker_df = df[df['Ticker'] == ticker].copy()
-                ticker_data = {}
-                
-                # Основная статистика
-                ticker_data['total_trades'] = len(ticker_df)
-                ticker_data['ticker'] = ticker
-                
-                # Анализ направлений сделок
-                if 'Direction' in ticker_df.columns:
-                    buy_trades = len(ticker_df[ticker_df['Direction'] == 'Buy'])
-                    sell_trades = len(ticker_df[ticker_df['Direction'] == 'Sell'])
-                    ticker_data['buy_trades'] = buy_trades
-                    ticker_data['sell_trades'] = sell_trades
-                
-                # Анализ цен
-                if 'Price' in ticker_df.columns:
-                    prices = ticker_df['Price'].dropna()
-                    if len(prices) > 0:
-                        ticker_data['avg_price'] = prices.mean()
-                        ticker_data['min_price'] = prices.min()
-                        ticker_data['max_price'] = prices.max()
-                        ticker_data['price_std'] = prices.std()
-                        ticker_data['valid_price_trades'] = len(prices)
-                
-                # Анализ объемов
-                if 'Amount' in ticker_df.columns:
-                    amounts = ticker_df['Amount'].dropna()
-                    if len(amounts) > 0:
-                        ticker_data['avg_amount'] = amounts.mean()
-                        ticker_data['total_amount'] = amounts.sum()
-                        ticker_data['min_amount'] = amounts.min()
-                        ticker_data['max_amount'] = amounts.max()
-                        
-                        # Чистый объем с учетом направления (Buy: +, Sell: -)
-                        if 'Direction' in ticker_df.columns:
-                            net_amount = 0
-                            for _, row in ticker_df.iterrows():
-                                if pd.notna(row['Amount']):
-                                    if row['Direction'] == 'Buy':
-                                        net_amount += row['Amount']
-                                    elif row['Direction'] == 'Sell':
-                                        net_amount -= row['Amount']
-                            ticker_data['net_amount'] = net_amount
+            if arrays is None:
+                arrays = _trade_arrays(df)
+            codes, tickers = arrays['ticker_codes'], arrays['tickers']
+            has_ticker = codes >= 0
+            dirs = arrays['dirs']
+            
+            # Все показатели считаются векторизованными агрегатами groupby за один
+            # проход по столбцам, без отдельной выборки строк для каждого тикера
+            grouped = df.groupby('Ticker', sort=False, observed=True)
+            ticker_stats = grouped.size().to_frame('total_trades')
+            ticker_stats['ticker'] = ticker_stats.index
+            
+            # Анализ направлений сделок: счетчики по кодам тикеров и направлений
+            if dirs is not None:
+                direction_counts = pd.DataFrame({
+                    'buy_trades': np.bincount(codes[has_ticker & (dirs == 1)], minlength=len(tickers)),
+                    'sell_trades': np.bincount(codes[has_ticker & (dirs == -1)], minlength=len(tickers))
+                }, index=tickers)
+                ticker_stats = ticker_stats.join(direction_counts)
+            
+            # Анализ цен (только тикеры с валидными ценами). Бесконечные цены
+            # и объемы, как и в VWAP, считаются пропусками
+            if 'Price' in df.columns:
+                finite_prices = df['Price'].where(np.isfinite(arrays['price']))
+                price_stats = finite_prices.groupby(df['Ticker'], sort=False, observed=True).agg(
+                    avg_price='mean', min_price='min', max_price='max',
+                    price_std='std', valid_price_trades='count'
+                )
+                ticker_stats = ticker_stats.join(price_stats[price_stats['valid_price_trades'] > 0])
+                ticker_stats['valid_price_trades'] = ticker_stats['valid_price_trades'].astype('Int64')
+            
+            # Анализ объемов (только тикеры с валидными объемами)
+            if 'Amount' in df.columns:
+                finite_amounts = df['Amount'].where(np.isfinite(arrays['amount']))
+                amount_stats = finite_amounts.groupby(df['Ticker'], sort=False, observed=True).agg(
+                    avg_amount='mean', total_amount='sum', min_amount='min',
+                    max_amount='max', valid_amount_trades='count'
+                )
                 
-                # VWAP для тикера
-                if 'Price' in ticker_df.columns and 'Amount' in ticker_df.columns:
-                    clean_ticker_df = ticker_df[['Price', 'Amount']].dropna()
-                    if len(clean_ticker_df) > 0:
-                        total_volume = clean_ticker_df['Amount'].sum()
-                        if total_volume > 0:
-                            vwap = (clean_ticker_df['Price'] * clean_ticker_df['Amount']).sum() / total_volume
-                            ticker_data['vwap'] = vwap
-                            ticker_data['total_turnover'] = (clean_ticker_df['Price'] * clean_ticker_df['Amount']).sum()
+                # Чистый объем с учетом направления (Buy: +, Sell: -)
+                if dirs is not None:
+                    signed_amounts = arrays['amount'] * dirs
+                    has_signed = has_ticker & np.isfinite(signed_amounts)
+                    amount_stats['net_amount'] = pd.Series(np.bincount(
+                        codes[has_signed], weights=signed_amounts[has_signed], minlength=len(tickers)
+                    ), index=tickers)
                 
-                ticker_results[ticker] = ticker_data
+                amount_stats = amount_stats[amount_stats['valid_amount_trades'] > 0]
+                ticker_stats = ticker_stats.join(amount_stats.drop(columns='valid_amount_trades'))
+            
+            # VWAP для тикера: Σ(Price × Amount) и Σ(Amount) по строкам с валидными Price и Amount
+            if 'Price' in df.columns and 'Amount' in df.columns:
+                ticker_stats = ticker_stats.join(_ticker_vwap(codes, tickers, arrays['amount'], arrays['pv']))
+            
+            # DataFrame сохраняется для листа Excel как есть
+            self._last_ticker_stats = ticker_stats
+            
+            # Пропуски означают, что показатель для тикера не рассчитывался
+            ticker_results = {
+                ticker: {key: value for key, value in data.items() if pd.notna(value)}
+                for ticker, data in ticker_stats.to_dict(orient='index').items()
+            }
                 
         except Exception as e:
-            logger.error(f"Ошибка при анализе по тикерам: {e}")
+            logger.error("Ошибка при анализе по тикерам: %s", e)
         
         return ticker_results
     
-    def analyze_current_session_trades(self, df: pd.DataFrame) -> Dict[str, Any]:
+    @staticmethod
+    def _current_session_mask(df: pd.DataFrame) -> np.ndarray:
+        """
+        Возвращает маску сделок текущей сессии (переносы имеют время 00:00:00)
+        
+        Args:
+            df: DataFrame с данными о сделках (должен содержать столбец DateCreate)
+            
+        Returns:
+            Булев массив NumPy для строк текущей сессии
+        """
+        return df['DateCreate'].to_numpy() != '00:00:00'
+    
+    def analyze_current_session_trades(self, df: pd.DataFrame,
+                                       arrays: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Анализирует только сделки текущей сессии (исключая переносы с 00:00:00)
         
         Args:
             df: DataFrame с данными о сделках
+            arrays: Массивы столбцов из _trade_arrays(df) (если None - строятся здесь)
             
         Returns:
             Результаты анализа сделок текущей сессии
@@ -667,98 +1176,103 @@ class TradesAnalyzer:
         try:
             # Разделяем на переносы и текущую сессию
             if 'DateCreate' in df.columns:
-                current_session_df = df[df['DateCreate'] != '00:00:00'].copy()
-                transfers_df = df[df['DateCreate'] == '00:00:00'].copy()
+                if arrays is None:
+                    arrays = _trade_arrays(df)
+                
+                # Маска считается один раз; выборка строк DataFrame не строится -
+                # маской фильтруются только нужные для расчетов массивы
+                current_session_mask = self._current_session_mask(df)
+                session_count = int(np.count_nonzero(current_session_mask))
                 
-                if len(current_session_df) == 0:
+                if session_count == 0:
                     logger.warning("Нет сделок текущей сессии для анализа")
                     return {"error": "Нет сделок текущей сессии"}
                 
+                prices = arrays['price'][current_session_mask]
+                amounts = arrays['amount'][current_session_mask]
+                session_pv = arrays['pv'][current_session_mask]
+                session_dirs = arrays['dirs'][current_session_mask] if arrays['dirs'] is not None else None
+                
                 # Общая статистика сделок текущей сессии
-                results['current_session_trades'] = len(current_session_df)
-                results['transfers_trades'] = len(transfers_df)
+                results['current_session_trades'] = session_count
+                results['transfers_trades'] = len(df) - session_count
                 
                 # Анализ направлений для сделок текущей сессии
-                if 'Direction' in current_session_df.columns:
-                    buy_trades = len(current_session_df[current_session_df['Direction'] == 'Buy'])
-                    sell_trades = len(current_session_df[current_session_df['Direction'] == 'Sell'])
-                    results['current_session_buy_trades'] = buy_trades
-                    results['current_session_sell_trades'] = sell_trades
+                if session_dirs is not None:
+                    # Buy и Sell считаются по числовым кодам направлений
+                    results['current_session_buy_trades'] = int(np.count_nonzero(session_dirs == 1))
+                    results['current_session_sell_trades'] = int(np.count_nonzero(session_dirs == -1))
                 
                 # Анализ цен и объемов для сделок текущей сессии
-                if 'Price' in current_session_df.columns and 'Amount' in current_session_df.columns:
-                    clean_current_df = current_session_df[['Price', 'Amount']].dropna()
+                if 'Price' in df.columns and 'Amount' in df.columns:
+                    valid_count, total_volume, price_sum, turnover = _vwap_stats(
+                        *_valid_price_amount(prices, amounts, session_pv)
+                    )
                     
-                    if len(clean_current_df) > 0:
+                    if valid_count > 0:
                         # Простые средние
-                        results['current_session_avg_price'] = clean_current_df['Price'].mean()
-                        results['current_session_avg_amount'] = clean_current_df['Amount'].mean()
-                        results['current_session_total_volume'] = clean_current_df['Amount'].sum()
+                        results['current_session_avg_price'] = price_sum / valid_count
+                        results['current_session_avg_amount'] = total_volume / valid_count
+                        results['current_session_total_volume'] = total_volume
                         
                         # VWAP для сделок текущей сессии
-                        total_volume = clean_current_df['Amount'].sum()
                         if total_volume > 0:
-                            vwap = (clean_current_df['Price'] * clean_current_df['Amount']).sum() / total_volume
-                            results['current_session_vwap'] = vwap
-                            results['current_session_turnover'] = (clean_current_df['Price'] * clean_current_df['Amount']).sum()
+                            results['current_session_vwap'] = turnover / total_volume
+                            results['current_session_turnover'] = turnover
                 
                 # Анализ по тикерам для сделок текущей сессии
-                if 'Ticker' in current_session_df.columns:
-                    current_session_ticker_analysis = {}
+                if arrays['ticker_codes'] is not None:
+                    # Все показатели считаются по целочисленным кодам тикеров всего файла
+                    # одним набором проходов по массивам, без выборки строк для каждого тикера
+                    codes = arrays['ticker_codes'][current_session_mask]
+                    agg = _aggregate_tickers(codes, session_dirs, prices, amounts,
+                                             len(arrays['tickers']), session_pv)
                     
-                    for ticker in current_session_df['Ticker'].unique():
-                        ticker_current_df = current_session_df[current_session_df['Ticker'] == ticker].copy()
-                        ticker_data = {}
-                        
-                        ticker_data['current_session_trades'] = len(ticker_current_df)
-                        
-                        if 'Direction' in ticker_current_df.columns:
-                            ticker_data['current_buy_trades'] = len(ticker_current_df[ticker_current_df['Direction'] == 'Buy'])
-                            ticker_data['current_sell_trades'] = len(ticker_current_df[ticker_current_df['Direction'] == 'Sell'])
-                        
-                        if 'Price' in ticker_current_df.columns:
-                            prices = ticker_current_df['Price'].dropna()
-                            if len(prices) > 0:
-                                ticker_data['current_avg_price'] = prices.mean()
-                                ticker_data['current_min_price'] = prices.min()
-                                ticker_data['current_max_price'] = prices.max()
-                        
-                        if 'Amount' in ticker_current_df.columns:
-                            amounts = ticker_current_df['Amount'].dropna()
-                            if len(amounts) > 0:
-                                ticker_data['current_avg_amount'] = amounts.mean()
-                                ticker_data['current_total_amount'] = amounts.sum()
-                                
-                                # Чистый объем текущей сессии с учетом направления (Buy: +, Sell: -)
-                                if 'Direction' in ticker_current_df.columns:
-                                    net_amount = 0
-                                    for _, row in ticker_current_df.iterrows():
-                                        if pd.notna(row['Amount']):
-                                            if row['Direction'] == 'Buy':
-                                                net_amount += row['Amount']
-                                            elif row['Direction'] == 'Sell':
-                                                net_amount -= row['Amount']
-                                    ticker_data['current_net_amount'] = net_amount
-                        
-                        # VWAP для тикера (только текущая сессия)
-                        if 'Price' in ticker_current_df.columns and 'Amount' in ticker_current_df.columns:
-                            clean_ticker_df = ticker_current_df[['Price', 'Amount']].dropna()
-                            if len(clean_ticker_df) > 0:
-                                total_volume = clean_ticker_df['Amount'].sum()
-                                if total_volume > 0:
-                                    vwap = (clean_ticker_df['Price'] * clean_ticker_df['Amount']).sum() / total_volume
-                                    ticker_data['current_vwap'] = vwap
-                                    ticker_data['current_turnover'] = (clean_ticker_df['Price'] * clean_ticker_df['Amount']).sum()
-                        
-                        current_session_ticker_analysis[ticker] = ticker_data
+                    # В результат попадают только тикеры со сделками в сессии,
+                    # в порядке их первой сделки в сессии
+                    session_codes, first_index = np.unique(codes[codes >= 0], return_index=True)
+                    order = session_codes[np.argsort(first_index)]
+                    agg = {key: values[order] for key, values in agg.items()}
+                    
+                    # Показатели без валидных значений остаются NaN и не попадают в результат
+                    has_price = agg['price_count'] > 0
+                    has_amount = agg['amount_count'] > 0
+                    has_volume = agg['volume'] > 0
+                    no_value = np.full(len(order), np.nan)
+                    
+                    session_stats = pd.DataFrame({'current_session_trades': agg['trades']},
+                                                 index=arrays['tickers'][order])
+                    if session_dirs is not None:
+                        session_stats['current_buy_trades'] = agg['buy_trades']
+                        session_stats['current_sell_trades'] = agg['sell_trades']
+                    session_stats['current_avg_price'] = np.divide(
+                        agg['price_sum'], agg['price_count'], out=no_value.copy(), where=has_price
+                    )
+                    session_stats['current_min_price'] = np.where(has_price, agg['price_min'], np.nan)
+                    session_stats['current_max_price'] = np.where(has_price, agg['price_max'], np.nan)
+                    session_stats['current_avg_amount'] = np.divide(
+                        agg['amount_sum'], agg['amount_count'], out=no_value.copy(), where=has_amount
+                    )
+                    session_stats['current_total_amount'] = np.where(has_amount, agg['amount_sum'], np.nan)
+                    if session_dirs is not None:
+                        session_stats['current_net_amount'] = np.where(has_amount, agg['net_amount'], np.nan)
+                    
+                    # VWAP для тикера (только текущая сессия)
+                    session_stats['current_vwap'] = np.divide(
+                        agg['turnover'], agg['volume'], out=no_value.copy(), where=has_volume
+                    )
+                    session_stats['current_turnover'] = np.where(has_volume, agg['turnover'], np.nan)
+                    
+                    # Пропуски означают, что показатель для тикера не рассчитывался
+                    current_session_ticker_analysis = {
+                        ticker: {key: value for key, value in data.items() if pd.notna(value)}
+                        for ticker, data in session_stats.to_dict(orient='index').items()
+                    }
                     
                     results['current_session_ticker_analysis'] = current_session_ticker_analysis
                 
-                # Сохраняем отфильтрованные данные для Excel
-                results['current_session_dataframe'] = current_session_df
-                
         except Exception as e:
-            logger.error(f"Ошибка при анализе сделок текущей сессии: {e}")
+            logger.error("Ошибка при анализе сделок текущей сессии: %s", e)
         
         return results
     
@@ -808,7 +1322,7 @@ class TradesAnalyzer:
                     df = self.load_trades(copied_filepath)
                     if df is not None:
                         # Создаем только аналитический Excel (без промежуточных)
-                        parsed_excel_path = self.create_parsed_excel(df, copied_filepath)
+                        parsed_dump_path = self.create_parsed_dump(df, copied_filepath)
                         results = self.calculate_averages(df)
                         excel_path = self.create_and_open_excel(df, copied_filepath)
                         
@@ -901,8 +1415,8 @@ class TradesAnalyzer:
         if df is None:
             return {"error": "Не удалось загрузить данные из файла"}
         
-        # Создаем Excel файл с распарсенными данными (но не открываем)
-        parsed_excel_path = self.create_parsed_excel(df, copied_filepath)
+        # Сохраняем распарсенные данные в Parquet (промежуточный файл)
+        parsed_dump_path = self.create_parsed_dump(df, copied_filepath)
         
         # Вычисляем средние (включая анализ по тикерам)
         results = self.calculate_averages(df)
@@ -911,7 +1425,7 @@ class TradesAnalyzer:
         excel_path = self.create_and_open_excel(df, copied_filepath)
         results['source_file'] = original_filepath
         results['copied_file'] = copied_filepath
-        results['parsed_excel_file'] = parsed_excel_path
+        results['parsed_dump_file'] = parsed_dump_path
         results['excel_file'] = excel_path
         
         return results
@@ -927,91 +1441,97 @@ class TradesAnalyzer:
             print(f"❌ Ошибка: {results['error']}")
             return
         
-        print("\n" + "="*60)
-        print("📊 АНАЛИЗ ТОРГОВЫХ СДЕЛОК")
-        print("="*60)
+        lines = []
+        out = lines.append
+        
+        out("\n" + "="*60)
+        out("📊 АНАЛИЗ ТОРГОВЫХ СДЕЛОК")
+        out("="*60)
         
         if 'source_file' in results:
-            print(f"📁 Исходный файл: {os.path.basename(results['source_file'])}")
+            out(f"📁 Исходный файл: {os.path.basename(results['source_file'])}")
         
         if 'copied_file' in results:
-            print(f"📂 Скопирован в: {os.path.relpath(results['copied_file'])}")
+            out(f"📂 Скопирован в: {os.path.relpath(results['copied_file'])}")
         
-        if 'parsed_excel_file' in results and results['parsed_excel_file']:
-            print(f"📋 Распарсенный Excel: {os.path.relpath(results['parsed_excel_file'])}")
+        if 'parsed_dump_file' in results and results['parsed_dump_file']:
+            out(f"📋 Распарсенные данные: {os.path.relpath(results['parsed_dump_file'])}")
         
         if 'excel_file' in results and results['excel_file']:
-            print(f"📊 Аналитический Excel: {os.path.relpath(results['excel_file'])}")
+            out(f"📊 Аналитический Excel: {os.path.relpath(results['excel_file'])}")
         
         if 'total_trades' in results:
-            print(f"📈 Всего сделок: {results['total_trades']}")
+            out(f"📈 Всего сделок: {results['total_trades']}")
         
         if 'valid_trades_count' in results:
-            print(f"✅ Валидных сделок: {results['valid_trades_count']}")
+            out(f"✅ Валидных сделок: {results['valid_trades_count']}")
         
         # Общая статистика
         if 'total_volume' in results:
-            print(f"📦 Общий объем: {results['total_volume']:.4f}")
+            out(f"📦 Общий объем: {results['total_volume']:.4f}")
         
         if 'total_turnover' in results:
-            print(f"💰 Общий оборот: {results['total_turnover']:,.2f} ₽")
+            out(f"💰 Общий оборот: {results['total_turnover']:,.2f} ₽")
         
         # Простые средние значения
-        print("\n📊 ПРОСТЫЕ СРЕДНИЕ ЗНАЧЕНИЯ:")
-        print("-" * 40)
+        out("\n📊 ПРОСТЫЕ СРЕДНИЕ ЗНАЧЕНИЯ:")
+        out("-" * 40)
         
         for key, value in results.items():
             if key.startswith('avg_'):
                 column_name = key[4:]  # Убираем префикс 'avg_'
                 if column_name == 'Price':
-                    print(f"Средняя цена: {value:,.4f} ₽")
+                    out(f"Средняя цена: {value:,.4f} ₽")
                 elif column_name == 'Amount':
-                    print(f"Средний объем: {value:.4f}")
+                    out(f"Средний объем: {value:.4f}")
                 else:
-                    print(f"{column_name}: {value:.4f}")
+                    out(f"{column_name}: {value:.4f}")
         
         # Средневзвешенные значения
         has_weighted = any(key in results for key in ['vwap_price', 'weighted_avg_amount'])
         if has_weighted:
-            print("\n⚖️  СРЕДНЕВЗВЕШЕННЫЕ ЗНАЧЕНИЯ:")
-            print("-" * 40)
+            out("\n⚖️  СРЕДНЕВЗВЕШЕННЫЕ ЗНАЧЕНИЯ:")
+            out("-" * 40)
             
             if 'vwap_price' in results:
-                print(f"VWAP (средневзвешенная цена): {results['vwap_price']:,.4f} ₽")
+                out(f"VWAP (средневзвешенная цена): {results['vwap_price']:,.4f} ₽")
             
             if 'weighted_avg_amount' in results:
-                print(f"Средневзвешенный объем: {results['weighted_avg_amount']:.4f}")
+                out(f"Средневзвешенный объем: {results['weighted_avg_amount']:.4f}")
         
         # Анализ по тикерам
         if 'ticker_analysis' in results and results['ticker_analysis']:
-            print("\n📊 АНАЛИЗ ПО ТИКЕРАМ:")
-            print("="*60)
+            out("\n📊 АНАЛИЗ ПО ТИКЕРАМ:")
+            out("="*60)
             
             for ticker, data in results['ticker_analysis'].items():
-                print(f"\n🔸 {ticker}:")
-                print(f"   Сделок: {data.get('total_trades', 0)} (Buy: {data.get('buy_trades', 0)}, Sell: {data.get('sell_trades', 0)})")
+                out(f"\n🔸 {ticker}:")
+                out(f"   Сделок: {data.get('total_trades', 0)} (Buy: {data.get('buy_trades', 0)}, Sell: {data.get('sell_trades', 0)})")
                 
                 if 'avg_price' in data:
-                    print(f"   Средняя цена: {data['avg_price']:,.4f} ₽")
+                    out(f"   Средняя цена: {data['avg_price']:,.4f} ₽")
                 if 'min_price' in data and 'max_price' in data:
-                    print(f"   Диапазон цен: {data['min_price']:,.4f} - {data['max_price']:,.4f} ₽")
+                    out(f"   Диапазон цен: {data['min_price']:,.4f} - {data['max_price']:,.4f} ₽")
                 if 'vwap' in data:
-                    print(f"   VWAP: {data['vwap']:,.4f} ₽")
+                    out(f"   VWAP: {data['vwap']:,.4f} ₽")
                 if 'avg_amount' in data:
-                    print(f"   Средний объем: {data['avg_amount']:.2f}")
+                    out(f"   Средний объем: {data['avg_amount']:.2f}")
                 if 'total_amount' in data:
-                    print(f"   Общий объем: {data['total_amount']:.0f}")
+                    out(f"   Общий объем: {data['total_amount']:.0f}")
                 if 'net_amount' in data:
                     net_val = data['net_amount']
                     direction = "📈" if net_val > 0 else "📉" if net_val < 0 else "➡️"
-                    print(f"   Чистый объем: {direction} {net_val:+.0f}")
+                    out(f"   Чистый объем: {direction} {net_val:+.0f}")
                 if 'total_turnover' in data:
-                    print(f"   Оборот: {data['total_turnover']:,.2f} ₽")
+                    out(f"   Оборот: {data['total_turnover']:,.2f} ₽")
         
         if 'analysis_date' in results:
-            print(f"\n⏰ Дата анализа: {results['analysis_date']}")
+            out(f"\n⏰ Дата анализа: {results['analysis_date']}")
         
-        print("="*60)
+        out("="*60)
+        
+        # Отчет собирается построчно и выводится одной записью в stdout
+        sys.stdout.write("\n".join(lines) + "\n")
 
 
 def main():
@@ -5,10 +5,12 @@ ULTIMATE REAL-TIME МОНИТОРИНГ ВСЕХ ФЬЮЧЕРСОВ
 С отображением реальной задержки на основе ms_timestamp
 """
 
+import bisect
 import os
 import sys
+from collections import deque
 from datetime import datetime
-from time import sleep
+from time import sleep, time
 import threading
 
 # Добавляем путь к AlorPy
@@ -16,6 +18,104 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'AlorPy'))
 
 from AlorPy import AlorPy
 
+# Таблица перерисовывается отдельным потоком не чаще 10 раз в секунду
+RENDER_INTERVAL = 0.1
+
+# ANSI: курсор в начало экрана и очистка экрана
+ANSI_CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+# Заголовок таблицы не меняется - форматируется один раз
+TABLE_HEADER = f"{'Фьючерс':<8} {'Bid':<12} {'Ask':<12} {'Спред':<8} {'Задержка':<10} {'Обновл.':<8} {'Время биржи':<12}"
+
+
+def enable_ansi_console():
+    """
+    Включает обработку ANSI-последовательностей в консоли
+    
+    На Windows 10+ включает режим ENABLE_VIRTUAL_TERMINAL_PROCESSING, в остальных
+    системах терминалы понимают ANSI сами.
+    
+    Returns:
+        True, если ANSI-последовательности можно использовать
+    """
+    if os.name != 'nt':
+        return sys.stdout.isatty()
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))  # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+    except Exception:
+        return False
+
+
+class LatencyWindow:
+    """Скользящее окно последних измерений задержки со средним, минимумом и максимумом за O(1)"""
+    
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self._count = 0       # Сколько измерений добавлено за все время
+        self._mins = deque()  # (номер, значение) по возрастанию значения - кандидаты в минимум
+        self._maxs = deque()  # (номер, значение) по убыванию значения - кандидаты в максимум
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def append(self, value):
+        """Добавляет измерение, вытесняя самое старое при заполненном окне"""
+        if len(self.values) == self.values.maxlen:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        
+        index = self._count
+        self._count += 1
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        self._mins.append((index, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        self._maxs.append((index, value))
+        
+        # Кандидаты, вышедшие за пределы окна
+        oldest = self._count - len(self.values)
+        while self._mins[0][0] < oldest:
+            self._mins.popleft()
+        while self._maxs[0][0] < oldest:
+            self._maxs.popleft()
+    
+    def mean(self):
+        return self.total / len(self.values) if self.values else 0
+    
+    def min(self):
+        return self._mins[0][1]
+    
+    def max(self):
+        return self._maxs[0][1]
+
+
+class Quote:
+    """Последняя котировка инструмента; обновляется на месте, без нового словаря на каждое событие"""
+    
+    __slots__ = ('bid', 'ask', 'spread', 'prev_bid', 'prev_ask', 'last_update',
+                 'exchange_ms', 'latency_ms', 'update_count', 'line_cache')
+    
+    def __init__(self):
+        self.bid = None
+        self.ask = None
+        self.spread = None
+        self.prev_bid = None
+        self.prev_ask = None
+        self.last_update = None  # мс эпохи
+        self.exchange_ms = None
+        self.latency_ms = None
+        self.update_count = 0
+        self.line_cache = None   # Строка таблицы, форматируется при отображении
+
 
 class UltimateRealTimeMonitor:
     """Ultimate real-time мониторинг с анализом задержки"""
@@ -27,11 +127,21 @@ class UltimateRealTimeMonitor:
         
         self.ap = AlorPy(refresh_token=self.refresh_token)
         self.instruments_data = {}
+        self._sorted_symbols = []  # Символы instruments_data по алфавиту (пополняется при новом символе)
         self.subscriptions = []
+        self._guid_to_symbol = {}  # guid подписки -> символ, заполняется при подписке
+        # Обработчик WebSocket только обновляет данные под блокировкой и взводит событие,
+        # таблицу рисует поток _render_loop
+        self._lock = threading.Lock()
+        self._render_event = threading.Event()
+        self._render_thread = None
         self.running = False
+        self.ansi_console = enable_ansi_console()
         self.update_count = 0
         self.start_time = None
-        self.latency_measurements = []
+        # Последние 50 и 10 измерений; суммы и экстремумы обновляются при добавлении
+        self.latency_measurements = LatencyWindow(50)
+        self._recent_latencies = LatencyWindow(10)
         
     def _load_token(self):
         """Загружает токен из .env"""
@@ -61,8 +171,12 @@ class UltimateRealTimeMonitor:
             return []
     
     def clear_screen(self):
-        """Очищает экран"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+        """Очищает экран (ANSI-последовательностью, без запуска cls/clear на каждый кадр)"""
+        if self.ansi_console:
+            sys.stdout.write(ANSI_CLEAR_SCREEN)
+            sys.stdout.flush()
+        else:
+            os.system('cls' if os.name == 'nt' else 'clear')
     
     def format_change_indicator(self, current, previous):
         """Форматирует индикатор изменения"""
@@ -76,80 +190,71 @@ class UltimateRealTimeMonitor:
         else:
             return "="
     
-    def calculate_latency(self, computer_time, data):
-        """Рассчитывает задержку на основе ms_timestamp"""
+    def calculate_latency(self, computer_ms, data):
+        """
+        Рассчитывает задержку на основе ms_timestamp
+        
+        Считается в миллисекундах эпохи, без создания datetime на каждое событие.
+        Возвращает (задержка в мс, время биржи в мс эпохи) или (None, None).
+        """
         try:
             if 'ms_timestamp' in data:
                 ms_ts = data['ms_timestamp']
                 if isinstance(ms_ts, (int, float)) and ms_ts > 1e12:
-                    exchange_time = datetime.fromtimestamp(ms_ts / 1000)
-                    latency_ms = (computer_time - exchange_time).total_seconds() * 1000
-                    return latency_ms, exchange_time
+                    return computer_ms - ms_ts, ms_ts
         except:
             pass
         return None, None
     
-    def on_orderbook_update(self, response):
-        """Обработчик обновления стакана"""
-        if not self.running:
-            return
-            
-        try:
-            computer_time = datetime.now()
-            data = response.get('data', {})
-            guid = response.get('guid')
-            
-            # Получаем символ из подписки
-            symbol = 'UNKNOWN'
-            if guid and guid in self.ap.subscriptions:
-                subscription = self.ap.subscriptions[guid]
-                symbol = subscription.get('code', 'UNKNOWN')
-            
-            if data.get('bids') and data.get('asks') and symbol != 'UNKNOWN':
-                bid = data['bids'][0]['price']
-                ask = data['asks'][0]['price']
-                spread = ask - bid
-                
-                # Рассчитываем задержку
-                latency_ms, exchange_time = self.calculate_latency(computer_time, data)
-                
-                # Сохраняем измерение задержки
-                if latency_ms is not None:
-                    self.latency_measurements.append(latency_ms)
-                    # Храним только последние 50 измерений
-                    if len(self.latency_measurements) > 50:
-                        self.latency_measurements.pop(0)
-                
-                # Сохраняем предыдущие данные
-                prev_data = self.instruments_data.get(symbol, {})
-                
-                # Обновляем данные
-                self.instruments_data[symbol] = {
-                    'bid': bid,
-                    'ask': ask,
-                    'spread': spread,
-                    'prev_bid': prev_data.get('bid'),
-                    'prev_ask': prev_data.get('ask'),
-                    'last_update': computer_time,
-                    'exchange_time': exchange_time,
-                    'latency_ms': latency_ms,
-                    'update_count': prev_data.get('update_count', 0) + 1
-                }
-                
-                self.update_count += 1
-                
-                # Обновляем дисплей каждые 3 обновления
-                if self.update_count % 3 == 0:
-                    self.display_table()
-                    
-        except Exception as e:
-            print(f"❌ Ошибка обработки: {e}")
+    def format_row(self, symbol, quote):
+        """Форматирует строку таблицы для инструмента"""
+        bid = quote.bid
+        ask = quote.ask
+        spread = quote.spread
+        latency_ms = quote.latency_ms
+        update_count = quote.update_count
+        exchange_ms = quote.exchange_ms
+        
+        # Индикаторы изменения
+        bid_ind = self.format_change_indicator(bid, quote.prev_bid)
+        ask_ind = self.format_change_indicator(ask, quote.prev_ask)
+        
+        # Форматируем задержку
+        if latency_ms is not None:
+            if latency_ms < 100:
+                latency_str = f"✅{latency_ms:>6.0f}мс"
+            elif latency_ms < 200:
+                latency_str = f"⚡{latency_ms:>6.0f}мс"
+            else:
+                latency_str = f"⚠️{latency_ms:>6.0f}мс"
+        else:
+            latency_str = "   N/A   "
+        
+        # Время биржи
+        if exchange_ms:
+            # datetime создается только для отображаемой строки; формат - вручную, без strftime
+            exchange_time = datetime.fromtimestamp(exchange_ms / 1000)
+            time_str = (f"{exchange_time.hour:02d}:{exchange_time.minute:02d}:"
+                        f"{exchange_time.second:02d}.{exchange_time.microsecond // 1000:03d}")
+        else:
+            time_str = "N/A"
+        
+        # Индикатор активности
+        if update_count > 50:
+            activity = "🔥"
+        elif update_count > 20:
+            activity = "⚡"
+        elif update_count > 5:
+            activity = "📊"
+        else:
+            activity = "💤"
+        
+        return (f"{symbol:<8} {bid_ind}{bid:<11.2f} {ask_ind}{ask:<11.2f} {spread:<8.2f} "
+                f"{latency_str:<10} {activity}{update_count:<7d} {time_str:<12}")
     
     def get_avg_latency(self):
         """Возвращает среднюю задержку"""
-        if self.latency_measurements:
-            return sum(self.latency_measurements) / len(self.latency_measurements)
-        return 0
+        return self.latency_measurements.mean()
     
     def display_table(self):
         """Отображает таблицу котировок с задержкой"""
@@ -162,69 +267,39 @@ class UltimateRealTimeMonitor:
         print("🚀 ULTIMATE REAL-TIME МОНИТОРИНГ ФЬЮЧЕРСОВ (с анализом задержки)")
         print("=" * 100)
         
+        # Снимок данных под блокировкой: обработчик не меняет котировки посреди кадра
+        with self._lock:
+            update_count = self.update_count
+            avg_latency = self.get_avg_latency()
+            
+            # Инструменты по названию: список поддерживается отсортированным, без сортировки на кадр.
+            # Строка форматируется заново только после обновления котировки инструмента
+            rows = []
+            for symbol in self._sorted_symbols:
+                quote = self.instruments_data[symbol]
+                line = quote.line_cache
+                if line is None:
+                    line = quote.line_cache = self.format_row(symbol, quote)
+                rows.append(line)
+            
+            # Статистика задержки (последние 10)
+            recent_latencies = self._recent_latencies
+            recent_stats = None
+            if recent_latencies:
+                recent_stats = (recent_latencies.mean(), recent_latencies.min(), recent_latencies.max())
+        
         # Время работы и средняя задержка
         if self.start_time:
             uptime = (datetime.now() - self.start_time).total_seconds()
-            avg_latency = self.get_avg_latency()
-            print(f"⏰ Время работы: {uptime:.0f}с | 📊 Обновлений: {self.update_count} | ⚡ Средняя задержка: {avg_latency:.0f}мс")
+            print(f"⏰ Время работы: {uptime:.0f}с | 📊 Обновлений: {update_count} | ⚡ Средняя задержка: {avg_latency:.0f}мс")
         
-        print(f"{'Фьючерс':<8} {'Bid':<12} {'Ask':<12} {'Спред':<8} {'Задержка':<10} {'Обновл.':<8} {'Время биржи':<12}")
+        print(TABLE_HEADER)
         print("-" * 100)
-        
-        # Сортируем по названию инструмента
-        sorted_instruments = sorted(self.instruments_data.items())
-        
-        for symbol, data in sorted_instruments:
-            bid = data.get('bid', 0)
-            ask = data.get('ask', 0)
-            spread = data.get('spread', 0)
-            latency_ms = data.get('latency_ms')
-            update_count = data.get('update_count', 0)
-            exchange_time = data.get('exchange_time')
-            
-            # Индикаторы изменения
-            bid_ind = self.format_change_indicator(bid, data.get('prev_bid'))
-            ask_ind = self.format_change_indicator(ask, data.get('prev_ask'))
-            
-            # Форматируем задержку
-            if latency_ms is not None:
-                if latency_ms < 100:
-                    latency_str = f"✅{latency_ms:>6.0f}мс"
-                elif latency_ms < 200:
-                    latency_str = f"⚡{latency_ms:>6.0f}мс"
-                else:
-                    latency_str = f"⚠️{latency_ms:>6.0f}мс"
-            else:
-                latency_str = "   N/A   "
-            
-            # Время биржи
-            if exchange_time:
-                time_str = exchange_time.strftime("%H:%M:%S.%f")[:-3]
-            else:
-                time_str = "N/A"
-            
-            # Индикатор активности
-            if update_count > 50:
-                activity = "🔥"
-            elif update_count > 20:
-                activity = "⚡"
-            elif update_count > 5:
-                activity = "📊"
-            else:
-                activity = "💤"
-            
-            print(f"{symbol:<8} {bid_ind}{bid:<11.2f} {ask_ind}{ask:<11.2f} {spread:<8.2f} "
-                  f"{latency_str:<10} {activity}{update_count:<7d} {time_str:<12}")
-        
+        print("\n".join(rows))
         print("-" * 100)
         
-        # Статистика задержки
-        if self.latency_measurements:
-            recent_latencies = self.latency_measurements[-10:]  # Последние 10
-            avg_recent = sum(recent_latencies) / len(recent_latencies)
-            min_recent = min(recent_latencies)
-            max_recent = max(recent_latencies)
-            
+        if recent_stats:
+            avg_recent, min_recent, max_recent = recent_stats
             print(f"📈 Задержка (последние 10): Средняя {avg_recent:.0f}мс | "
                   f"Диапазон {min_recent:.0f}-{max_recent:.0f}мс")
         
@@ -232,54 +307,27 @@ class UltimateRealTimeMonitor:
         print(f"🔄 Обновлено: {current_time} | 🌐 WebSocket Real-time | ❌ Ctrl+C для выхода")
         print("=" * 100)
     
-    def start_monitoring(self):
-        """Запускает ultimate мониторинг"""
-        instruments = self.load_instruments_list()
-        
-        if not instruments:
-            print("❌ Список инструментов пуст")
-            return
-        
-        print("🚀 ULTIMATE REAL-TIME МОНИТОРИНГ")
-        print("=" * 60)
-        print(f"📊 Инструменты: {', '.join(instruments)}")
-        print("⚡ WebSocket подписка с анализом задержки...")
-        print("🎯 Ожидаемая задержка: ~120-150мс")
-        print("-" * 60)
-        
-        try:
-            # Устанавливаем обработчик
-            self.ap.on_change_order_book = self.on_orderbook_update
-            
-            # Подписываемся на все инструменты
-            for i, symbol in enumerate(instruments):
-                print(f"📡 {i+1}/{len(instruments)} Подписка на {symbol}...")
-                guid = self.ap.order_book_get_and_subscribe('MOEX', symbol)
-                self.subscriptions.append((guid, symbol))
-                sleep(0.3)  # Пауза между подписками
-            
-            print(f"✅ Все подписки созданы: {len(self.subscriptions)}")
-            print("🔥 Получение real-time данных с анализом задержки...")
-            print("-" * 60)
-            
-            self.start_time = datetime.now()
-            self.running = True
-            
-            # Ждем обновления
-            while self.running:
-                sleep(0.5)
-                
-        except KeyboardInterrupt:
-            print(f"\n🛑 Остановка мониторинга...")
-            self.stop_monitoring()
-            
-        except Exception as e:
-            print(f"❌ Ошибка: {e}")
-            self.stop_monitoring()
+    def _render_loop(self):
+        """Перерисовывает таблицу после обновлений, не чаще раза в RENDER_INTERVAL"""
+        while self.running:
+            self._render_event.wait()
+            if not self.running:
+                break
+            self._render_event.clear()
+            try:
+                self.display_table()
+            except Exception as e:
+                print(f"❌ Ошибка отображения: {e}")
+            sleep(RENDER_INTERVAL)
     
     def stop_monitoring(self):
         """Останавливает мониторинг с детальной статистикой"""
         self.running = False
+        self._render_event.set()  # Будим поток отрисовки, чтобы он завершился
+        # Дожидаемся кадра, который уже рисуется, - иначе он очистит экран
+        # поверх сообщений об отписке и финальной статистики
+        if self._render_thread is not None:
+            self._render_thread.join()
         
         print("📤 Отписка от обновлений...")
         for i, (guid, symbol) in enumerate(self.subscriptions):
@@ -292,7 +340,7 @@ class UltimateRealTimeMonitor:
         # Детальная финальная статистика
         if self.instruments_data and self.start_time:
             uptime = (datetime.now() - self.start_time).total_seconds()
-            total_updates = sum(data.get('update_count', 0) for data in self.instruments_data.values())
+            total_updates = sum(quote.update_count for quote in self.instruments_data.values())
             
             print(f"\n📈 ФИНАЛЬНАЯ СТАТИСТИКА:")
             print("="*60)
@@ -302,9 +350,9 @@ class UltimateRealTimeMonitor:
             
             # Статистика задержки
             if self.latency_measurements:
-                avg_latency = sum(self.latency_measurements) / len(self.latency_measurements)
-                min_latency = min(self.latency_measurements)
-                max_latency = max(self.latency_measurements)
+                avg_latency = self.latency_measurements.mean()
+                min_latency = self.latency_measurements.min()
+                max_latency = self.latency_measurements.max()
                 
                 print(f"\n⚡ АНАЛИЗ ЗАДЕРЖКИ:")
                 print(f"   📊 Измерений:      {len(self.latency_measurements)}")
@@ -321,10 +369,11 @@ class UltimateRealTimeMonitor:
             
             # Статистика по инструментам
             print(f"\n📊 АКТИВНОСТЬ ПО ИНСТРУМЕНТАМ:")
-            for symbol, data in sorted(self.instruments_data.items()):
-                updates = data.get('update_count', 0)
+            for symbol in self._sorted_symbols:
+                quote = self.instruments_data[symbol]
+                updates = quote.update_count
                 freq = updates / uptime
-                last_latency = data.get('latency_ms', 0)
+                last_latency = quote.latency_ms if quote.latency_ms is not None else 0
                 
                 if freq > 2:
                     activity_icon = "🔥"
@@ -358,50 +407,52 @@ class UltimateRealTimeMonitor:
             return
             
         try:
-            computer_time = datetime.now()
-            data = response.get('data', {})
-            guid = response.get('guid')
-            
-            # Получаем символ из подписки
-            symbol = 'UNKNOWN'
-            if guid and guid in self.ap.subscriptions:
-                subscription = self.ap.subscriptions[guid]
-                symbol = subscription.get('code', 'UNKNOWN')
+            computer_ms = time() * 1000
             
-            if data.get('bids') and data.get('asks') and symbol != 'UNKNOWN':
+            # Быстрый путь: символ по guid из своей таблицы, лучшие цены - прямой распаковкой.
+            # Чужие подписки и пустые стаканы пропускаются
+            try:
+                data = response['data']
+                symbol = self._guid_to_symbol[response['guid']]
                 bid = data['bids'][0]['price']
                 ask = data['asks'][0]['price']
-                spread = ask - bid
-                
-                # Рассчитываем задержку
-                latency_ms, exchange_time = self.calculate_latency(computer_time, data)
-                
+            except (KeyError, IndexError, TypeError):
+                return
+            
+            spread = ask - bid
+            
+            # Рассчитываем задержку
+            latency_ms, exchange_ms = self.calculate_latency(computer_ms, data)
+            
+            with self._lock:
                 # Сохраняем измерение задержки
                 if latency_ms is not None and 0 < latency_ms < 2000:  # Фильтруем аномальные значения
                     self.latency_measurements.append(latency_ms)
+                    self._recent_latencies.append(latency_ms)
                 
-                # Сохраняем предыдущие данные
-                prev_data = self.instruments_data.get(symbol, {})
+                quote = self.instruments_data.get(symbol)
+                if quote is None:
+                    quote = self.instruments_data[symbol] = Quote()
+                    # Новый символ встает на свое место в отсортированном списке
+                    bisect.insort(self._sorted_symbols, symbol)
                 
-                # Обновляем данные
-                self.instruments_data[symbol] = {
-                    'bid': bid,
-                    'ask': ask,
-                    'spread': spread,
-                    'prev_bid': prev_data.get('bid'),
-                    'prev_ask': prev_data.get('ask'),
-                    'last_update': computer_time,
-                    'exchange_time': exchange_time,
-                    'latency_ms': latency_ms,
-                    'update_count': prev_data.get('update_count', 0) + 1
-                }
+                # Обновляем котировку на месте, предыдущие bid/ask сохраняются для индикаторов
+                quote.prev_bid = quote.bid
+                quote.prev_ask = quote.ask
+                quote.bid = bid
+                quote.ask = ask
+                quote.spread = spread
+                quote.last_update = computer_ms
+                quote.exchange_ms = exchange_ms
+                quote.latency_ms = latency_ms
+                quote.update_count += 1
+                quote.line_cache = None
                 
                 self.update_count += 1
+            
+            # Перерисовка - в потоке _render_loop, обработчик только сообщает об изменениях
+            self._render_event.set()
                 
-                # Обновляем дисплей каждые 5 обновлений
-                if self.update_count % 5 == 0:
-                    self.display_table()
-                    
         except Exception as e:
             print(f"❌ Ошибка обработки: {e}")
     
@@ -424,12 +475,13 @@ class UltimateRealTimeMonitor:
             # Устанавливаем обработчик
             self.ap.on_change_order_book = self.on_orderbook_update
             
-            # Подписываемся на все инструменты
+            # Подписываемся на все инструменты подряд и без пауз: AlorPy отправляет
+            # подписки через один общий WebSocket, параллельные вызовы для него небезопасны
             for i, symbol in enumerate(instruments):
                 print(f"📡 {i+1}/{len(instruments)} Подписка на {symbol}...")
                 guid = self.ap.order_book_get_and_subscribe('MOEX', symbol)
                 self.subscriptions.append((guid, symbol))
-                sleep(0.3)
+                self._guid_to_symbol[guid] = symbol
             
             print(f"✅ Все подписки созданы: {len(self.subscriptions)}")
             print("🔥 Получение real-time данных...")
@@ -437,6 +489,8 @@ class UltimateRealTimeMonitor:
             
             self.start_time = datetime.now()
             self.running = True
+            self._render_thread = threading.Thread(target=self._render_loop, name='monitor-render', daemon=True)
+            self._render_thread.start()
             
             # Ждем обновления
             while self.running: